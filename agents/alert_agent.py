@@ -2,11 +2,15 @@
 import logging
 from datetime import datetime
 from typing import Dict
+import numpy as np
 from langchain_core.messages import AIMessage
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from config import settings
-from data_tools import get_recent_measurements, save_alert, calculate_aqi
+from config import get_settings
+from data_tools import get_recent_measurements, calculate_aqi_vec
 from db.database import get_session
+from db.models import Alert
 
 logger = logging.getLogger(__name__)
 
@@ -21,48 +25,70 @@ class AlertAgentWorker:
         """Проверка превышений и генерация алертов"""
         logger.info(f"{self.name}: Checking for alerts")
         
+        # Одна сессия на весь прогон: чтение измерений и запись алертов
+        async for session in get_session():
+            result = await self._check_alerts(state, session)
+        
+        return result
+    
+    async def _check_alerts(self, state: Dict, session: AsyncSession) -> Dict:
+        """Проверка измерений и сохранение алертов в рамках одной сессии"""
         alerts_created = []
+        pending_alerts = []
         
-        # Получаем последние измерения
-        async for session in get_session():
-            measurements = await get_recent_measurements(session, hours=1)
+        # Пороги читаем один раз, а не на каждой итерации
+        thresholds = get_settings().AQI_THRESHOLDS
+        moderate = thresholds["moderate"]
+        unhealthy = thresholds["unhealthy"]
         
-        if not measurements:
+        # Читаем последние измерения потоком, оставляя только строки с PM2.5
+        measurements_count = 0
+        with_pm25 = []
+        async for m in get_recent_measurements(session, hours=1):
+            measurements_count += 1
+            if m.pm25:
+                with_pm25.append(m)
+        
+        if not measurements_count:
             message = AIMessage(content="⚠️ No recent data to check")
             return {"messages": state["messages"] + [message], "data": {}}
         
-        # Проверяем каждое измерение
-        for m in measurements:
-            if not m.pm25:
-                continue
+        # Считаем AQI для всех измерений сразу и проходим только по превышениям
+        pm25 = np.fromiter((m.pm25 for m in with_pm25), dtype=np.float64, count=len(with_pm25))
+        aqi_values = calculate_aqi_vec(pm25)
+        
+        # Генерируем алерт если AQI > 100 (Unhealthy for Sensitive Groups)
+        for i in np.flatnonzero(aqi_values > moderate):
+            m = with_pm25[i]
+            aqi = int(aqi_values[i])
             
-            aqi = calculate_aqi(m.pm25)
+            severity = "warning"
+            if aqi > unhealthy:
+                severity = "danger"
             
-            # Генерируем алерт если AQI > 100 (Unhealthy for Sensitive Groups)
-            if aqi > settings.AQI_THRESHOLDS["moderate"]:
-                severity = "warning"
-                if aqi > settings.AQI_THRESHOLDS["unhealthy"]:
-                    severity = "danger"
-                
-                alert_data = {
-                    "location_name": m.location_name,
-                    "latitude": m.latitude,
-                    "longitude": m.longitude,
-                    "alert_type": "high_aqi",
-                    "severity": severity,
-                    "message": f"Высокий уровень загрязнения! PM2.5={m.pm25:.1f}, AQI={aqi}",
-                    "value": m.pm25,
-                    "threshold": settings.AQI_THRESHOLDS["moderate"],
-                    "is_active": True,
-                }
-                
-                async for session in get_session():
-                    alert = await save_alert(session, alert_data)
-                    alerts_created.append({
-                        "location": alert.location_name,
-                        "severity": alert.severity,
-                        "message": alert.message
-                    })
+            alert_data = {
+                "location_name": m.location_name,
+                "latitude": m.latitude,
+                "longitude": m.longitude,
+                "alert_type": "high_aqi",
+                "severity": severity,
+                "message": f"Высокий уровень загрязнения! PM2.5={m.pm25:.1f}, AQI={aqi}",
+                "value": m.pm25,
+                "threshold": moderate,
+                "is_active": True,
+            }
+            
+            pending_alerts.append(alert_data)
+            alerts_created.append({
+                "location": alert_data["location_name"],
+                "severity": alert_data["severity"],
+                "message": alert_data["message"]
+            })
+        
+        # Сохраняем все алерты одним пакетным INSERT и одним коммитом
+        if pending_alerts:
+            await session.execute(insert(Alert), pending_alerts)
+            await session.commit()
         
         if alerts_created:
             alert_text = "\n".join([
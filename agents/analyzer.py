@@ -1,12 +1,21 @@
 """Агент анализа экологических данных"""
+import asyncio
+import hashlib
+import heapq
 import logging
-from typing import Dict
+import time
+from collections import OrderedDict
+from operator import itemgetter
+from typing import Dict, Optional, Tuple
 from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
 from langchain_core.messages import AIMessage
-from langchain_groq import ChatGroq
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from config import settings
-from data_tools import get_recent_measurements, analyze_trend, detect_anomalies
+from agents.llm import get_llm
+from data_tools import get_recent_measurements_columnar, analyze_trend, detect_anomalies
 from db.database import get_session
 from db.models import Analysis
 
@@ -18,16 +27,81 @@ class AnalyzerAgent:
     
     def __init__(self):
         self.name = "AnalyzerAgent"
-        self.llm = ChatGroq(
-            temperature=0.3,
-            model_name=settings.GROQ_MODEL,
-            groq_api_key=settings.GROQ_API_KEY
+        self.llm = get_llm(temperature=0.3)
+        # LRU-кэш ответов LLM: ключ -> (время записи, резюме, детальный анализ)
+        self._llm_cache = OrderedDict()
+        self.llm_cache_size = 128
+        self.llm_cache_ttl = 15 * 60  # секунд
+    
+    @staticmethod
+    def _llm_cache_key(analysis_text: str, location_filter: Optional[str]) -> str:
+        """Ключ кэша по хэшу данных отчета и фильтру города"""
+        digest = hashlib.blake2b(analysis_text.encode(), digest_size=16).hexdigest()
+        return f"{digest}|{location_filter or ''}"
+    
+    def _llm_cache_get(self, key: str) -> Optional[Tuple[str, str]]:
+        """Получение ответа из кэша с учетом TTL"""
+        entry = self._llm_cache.get(key)
+        if entry is None:
+            return None
+        
+        created, summary, detailed_analysis = entry
+        if time.monotonic() - created > self.llm_cache_ttl:
+            del self._llm_cache[key]
+            return None
+        
+        self._llm_cache.move_to_end(key)
+        return summary, detailed_analysis
+    
+    def _llm_cache_put(self, key: str, summary: str, detailed_analysis: str):
+        """Сохранение ответа в кэш с вытеснением самых старых записей"""
+        self._llm_cache[key] = (time.monotonic(), summary, detailed_analysis)
+        self._llm_cache.move_to_end(key)
+        while len(self._llm_cache) > self.llm_cache_size:
+            self._llm_cache.popitem(last=False)
+    
+    async def _generate_report(self, summary_prompt: str, detailed_prompt: str, cache_key: str) -> Tuple[str, str]:
+        """Запрос резюме и детального анализа у LLM"""
+        # Резюме и детальный анализ независимы - запрашиваем параллельно
+        logger.info("Calling LLM for summary and detailed analysis...")
+        summary_response, detailed_response = await asyncio.gather(
+            self.llm.ainvoke(summary_prompt),
+            self.llm.ainvoke(detailed_prompt),
+            return_exceptions=True,
         )
+        
+        if isinstance(summary_response, Exception):
+            logger.error(f"LLM summary error: {summary_response}", exc_info=summary_response)
+            summary = "Анализ выполнен, данные собраны за неделю."
+        else:
+            summary = summary_response.content
+            logger.info(f"Summary received: {summary[:100]}...")
+        
+        if isinstance(detailed_response, Exception):
+            logger.error(f"LLM analysis error: {detailed_response}", exc_info=detailed_response)
+            detailed_analysis = f"Детальный анализ временно недоступен. Ошибка: {str(detailed_response)}"
+        else:
+            detailed_analysis = detailed_response.content
+            logger.info(f"Detailed analysis received: {len(detailed_analysis)} chars")
+        
+        # Кэшируем только полностью успешные ответы
+        if not isinstance(summary_response, Exception) and not isinstance(detailed_response, Exception):
+            self._llm_cache_put(cache_key, summary, detailed_analysis)
+        
+        return summary, detailed_analysis
     
     async def execute(self, state: Dict) -> Dict:
         """Выполнение анализа данных"""
         logger.info(f"{self.name}: Starting analysis")
         
+        # Одна сессия на весь прогон: чтение измерений и запись результатов
+        async for session in get_session():
+            result = await self._analyze(state, session)
+        
+        return result
+    
+    async def _analyze(self, state: Dict, session: AsyncSession) -> Dict:
+        """Анализ измерений и сохранение результатов в рамках одной сессии"""
         # ✅ Получаем фильтр по городу из state
         location_filter = state.get("data", {}).get("location_filter")
         logger.info(f"Location filter: {location_filter}")
@@ -36,68 +110,68 @@ class AnalyzerAgent:
         period_end = datetime.utcnow()
         period_start = period_end - timedelta(hours=168)
         
+        # ✅ Фильтр по городу применяется прямо в SQL-запросе
+        location_prefix = location_filter if location_filter and location_filter != "Все города" else None
+        
         # Получаем данные за последнюю неделю
-        async for session in get_session():
-            measurements = await get_recent_measurements(session, hours=168)
+        measurements = await get_recent_measurements_columnar(session, hours=168, location_prefix=location_prefix)
         
-        if not measurements:
-            message = AIMessage(content="⚠️ No data available for analysis")
+        if not len(measurements):
+            if location_prefix:
+                message = AIMessage(content=f"⚠️ No data for {location_filter}")
+            else:
+                message = AIMessage(content="⚠️ No data available for analysis")
             return {"messages": state["messages"] + [message], "data": {}}
         
-        # ✅ Фильтруем измерения по городу, если фильтр задан
-        if location_filter and location_filter != "Все города":
-            measurements = [
-                m for m in measurements 
-                if m.location_name.startswith(location_filter)
-            ]
-            
-            if not measurements:
-                message = AIMessage(content=f"⚠️ No data for {location_filter}")
-                return {"messages": state["messages"] + [message], "data": {}}
+        # Группируем по локациям в pandas; 0 и NULL считаются отсутствием данных
+        df = pd.DataFrame({
+            "location": measurements.location_name,
+            "pm25": measurements.pm25,
+            "temp": measurements.temperature,
+        })
+        df[["pm25", "temp"]] = df[["pm25", "temp"]].replace(0.0, np.nan)
+        grouped = df.groupby("location", sort=False)
         
-        # Группируем по локациям
-        locations_data = {}
-        for m in measurements:
-            if m.location_name not in locations_data:
-                locations_data[m.location_name] = {"pm25": [], "pm10": [], "no2": [], "temp": []}
-            
-            if m.pm25:
-                locations_data[m.location_name]["pm25"].append(m.pm25)
-            if m.pm10:
-                locations_data[m.location_name]["pm10"].append(m.pm10)
-            if m.no2:
-                locations_data[m.location_name]["no2"].append(m.no2)
-            if m.temperature:
-                locations_data[m.location_name]["temp"].append(m.temperature)
+        stats = grouped.agg(
+            avg_pm25=("pm25", "mean"),
+            min_pm25=("pm25", "min"),
+            max_pm25=("pm25", "max"),
+            avg_temp=("temp", "mean"),
+        ).fillna(0)
         
         # Анализируем тренды и аномалии
-        for location, data in locations_data.items():
-            pm25_trend = analyze_trend(data["pm25"]) if data["pm25"] else "no_data"
-            pm25_anomalies = detect_anomalies(data["pm25"]) if len(data["pm25"]) > 3 else []
-            avg_pm25 = sum(data["pm25"]) / len(data["pm25"]) if data["pm25"] else 0
-            max_pm25 = max(data["pm25"]) if data["pm25"] else 0
-            min_pm25 = min(data["pm25"]) if data["pm25"] else 0
-            avg_temp = sum(data["temp"]) / len(data["temp"]) if data["temp"] else 0
+        for location, pm25_series in grouped["pm25"]:
+            pm25 = pm25_series.dropna().to_numpy()
+            row = stats.loc[location]
+            
+            pm25_trend = analyze_trend(pm25) if pm25.size else "no_data"
+            pm25_anomalies = detect_anomalies(pm25) if pm25.size > 3 else []
             
             analysis_results.append({
                 "location": location,
                 "pm25_trend": pm25_trend,
                 "pm25_anomalies_count": len(pm25_anomalies),
-                "avg_pm25": avg_pm25,
-                "max_pm25": max_pm25,
-                "min_pm25": min_pm25,
-                "avg_temp": avg_temp,
+                "avg_pm25": float(row["avg_pm25"]),
+                "max_pm25": float(row["max_pm25"]),
+                "min_pm25": float(row["min_pm25"]),
+                "avg_temp": float(row["avg_temp"]),
             })
         
         # Генерируем детальный отчет
-        analysis_text = "\n".join([
-            f"📍 {r['location']}:\n"
-            f"   - Тренд: {r['pm25_trend']}\n"
-            f"   - PM2.5: среднее={r['avg_pm25']:.1f}, мин={r['min_pm25']:.1f}, макс={r['max_pm25']:.1f}\n"
-            f"   - Аномалий: {r['pm25_anomalies_count']}\n"
-            f"   - Средняя температура: {r['avg_temp']:.1f}°C"
-            for r in analysis_results[:10]
-        ])
+        parts = []
+        append = parts.append
+        # В отчет попадают 10 локаций с наибольшим средним PM2.5
+        for r in heapq.nlargest(10, analysis_results, key=itemgetter("avg_pm25")):
+            if parts:
+                append("\n")
+            append(
+                f"📍 {r['location']}:\n"
+                f"   - Тренд: {r['pm25_trend']}\n"
+                f"   - PM2.5: среднее={r['avg_pm25']:.1f}, мин={r['min_pm25']:.1f}, макс={r['max_pm25']:.1f}\n"
+                f"   - Аномалий: {r['pm25_anomalies_count']}\n"
+                f"   - Средняя температура: {r['avg_temp']:.1f}°C"
+            )
+        analysis_text = "".join(parts)
         
         # ✅ Адаптируем промпт под фильтр
         if location_filter and location_filter != "Все города":
@@ -147,46 +221,43 @@ class AnalyzerAgent:
 
 Пиши понятным языком, но профессионально. Используй emoji для наглядности."""
 
-        try:
-            # Краткое резюме
-            summary_prompt = f"Данные по {scope_text}: {analysis_text[:500]}\n\nНапиши КРАТКОЕ резюме (1 предложение) экологической обстановки."
-            
-            logger.info("Calling LLM for summary...")
-            summary_response = await self.llm.ainvoke(summary_prompt)
-            summary = summary_response.content
-            logger.info(f"Summary received: {summary[:100]}...")
-            
-            # Детальный анализ
-            logger.info("Calling LLM for detailed analysis...")
-            detailed_response = await self.llm.ainvoke(detailed_prompt)
-            detailed_analysis = detailed_response.content
-            logger.info(f"Detailed analysis received: {len(detailed_analysis)} chars")
-            
-        except Exception as e:
-            logger.error(f"LLM analysis error: {e}", exc_info=True)
-            summary = "Анализ выполнен, данные собраны за неделю."
-            detailed_analysis = f"Детальный анализ временно недоступен. Ошибка: {str(e)}"
+        # Краткое резюме
+        summary_prompt = f"Данные по {scope_text}: {analysis_text[:500]}\n\nНапиши КРАТКОЕ резюме (1 предложение) экологической обстановки."
         
-        # Сохраняем результаты в БД
-        async for session in get_session():
-            for result in analysis_results:
-                try:
-                    analysis = Analysis(
-                        analysis_type="weekly_trend",
-                        location_name=result["location"],
-                        pm25_trend=result["pm25_trend"],
-                        pm25_avg=result["avg_pm25"],
-                        anomalies_count=result["pm25_anomalies_count"],
-                        summary=summary,
-                        detailed_analysis=detailed_analysis,
-                        period_start=period_start,
-                        period_end=period_end
-                    )
-                    session.add(analysis)
-                except Exception as e:
-                    logger.error(f"Error saving analysis: {e}")
-            
-            await session.commit()
+        # Одинаковые данные дают одинаковый промпт - переиспользуем ответ LLM
+        cache_key = self._llm_cache_key(analysis_text, location_filter)
+        cached = self._llm_cache_get(cache_key)
+        if cached:
+            logger.info("LLM cache hit, skipping LLM calls")
+            summary, detailed_analysis = cached
+        else:
+            summary, detailed_analysis = await self._generate_report(
+                summary_prompt, detailed_prompt, cache_key
+            )
+        
+        # Сохраняем результаты в БД одним пакетным INSERT
+        rows = [
+            {
+                "analysis_type": "weekly_trend",
+                "location_name": result["location"],
+                "pm25_trend": result["pm25_trend"],
+                "pm25_avg": result["avg_pm25"],
+                "anomalies_count": result["pm25_anomalies_count"],
+                "summary": summary,
+                "detailed_analysis": detailed_analysis,
+                "period_start": period_start,
+                "period_end": period_end,
+            }
+            for result in analysis_results
+        ]
+        
+        if rows:
+            try:
+                await session.execute(insert(Analysis), rows)
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Error saving analysis: {e}")
+                await session.rollback()
         
         # ✅ Добавляем информацию о фильтре в ответ
         filter_info = f" для города {location_filter}" if location_filter and location_filter != "Все города" else ""
@@ -1,90 +1,127 @@
 """Агент сбора данных с Open-Meteo API"""
+import functools
 import logging
 from datetime import datetime
 from typing import Dict, List
+import numpy as np
 from langchain_core.messages import AIMessage
 
-from config import settings
-from data_tools import (
-    fetch_air_quality_data,
-    fetch_weather_data,
-    save_measurements,
-)
+from config import get_settings
+from data_tools import iter_locations_data, save_measurements, calculate_aqi_vec
 from db.database import get_session
 
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=512)
+def parse_hourly_time(value: str) -> datetime:
+    """Разбор времени Open-Meteo ("YYYY-MM-DDTHH:MM")
+    
+    Фиксированный формат разбирается по позициям; одни и те же часы
+    повторяются для всех точек мониторинга, поэтому результат кэшируется.
+    """
+    if len(value) == 16 and value[10] == "T":
+        return datetime(
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]),
+        )
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def last_values(hourly: Dict, key: str, n: int) -> List:
+    """Последние n значений ряда; недостающие в начале дополняются None"""
+    values = (hourly.get(key) or [])[-n:]
+    return [None] * (n - len(values)) + values
+
+
+def attach_aqi(measurements: List[Dict]) -> None:
+    """Проставляет AQI по PM2.5 всем измерениям одним векторным расчетом (None без PM2.5)"""
+    pm25 = np.array([m["pm25"] for m in measurements], dtype=np.float64)
+    has_pm25 = ~np.isnan(pm25)
+    aqi_values = calculate_aqi_vec(np.where(has_pm25, pm25, 0.0))
+    for m, aqi, ok in zip(measurements, aqi_values.tolist(), has_pm25.tolist()):
+        m["aqi"] = aqi if ok else None
+
+
 class DataCollectorAgent:
     """Агент для сбора данных о качестве воздуха и погоде"""
     
     def __init__(self):
         self.name = "DataCollectorAgent"
     
+    def _parse_location(self, location: Dict, air_data: Dict, weather_data: Dict) -> List[Dict]:
+        """Разбор почасовых данных одной точки мониторинга"""
+        measurements = []
+        
+        # Комбинируем данные
+        if air_data.get("hourly") and weather_data.get("hourly"):
+            hourly_air = air_data["hourly"]
+            hourly_weather = weather_data["hourly"]
+            
+            # ✅ ИСПРАВЛЕНИЕ: Берем последние 24 часа (все доступные данные)
+            num_points = min(len(hourly_air["time"]), 24)
+            
+            # Срезаем хвосты всех рядов один раз и идем по ним zip'ом
+            series = zip(
+                hourly_air["time"][-num_points:],
+                last_values(hourly_air, "pm2_5", num_points),
+                last_values(hourly_air, "pm10", num_points),
+                last_values(hourly_air, "nitrogen_dioxide", num_points),
+                last_values(hourly_air, "ozone", num_points),
+                last_values(hourly_air, "carbon_monoxide", num_points),
+                last_values(hourly_weather, "temperature_2m", num_points),
+                last_values(hourly_weather, "relative_humidity_2m", num_points),
+            )
+            
+            for time_str, pm25, pm10, no2, o3, co, temperature, humidity in series:
+                try:
+                    measurements.append({
+                        "location_name": location["name"],
+                        "latitude": location["lat"],
+                        "longitude": location["lon"],
+                        "timestamp": parse_hourly_time(time_str),
+                        "pm25": pm25,
+                        "pm10": pm10,
+                        "no2": no2,
+                        "o3": o3,
+                        "co": co,
+                        "temperature": temperature,
+                        "humidity": humidity,
+                    })
+                except Exception as e:
+                    logger.error(f"Error processing hour {time_str}: {e}")
+                    continue
+            
+            logger.info(f"Collected {num_points} hours of data for {location['name']}")
+        
+        return measurements
+    
     async def execute(self, state: Dict) -> Dict:
         """Выполнение сбора данных"""
         logger.info(f"{self.name}: Starting data collection")
         
         collected_data = []
         
-        # Собираем данные для каждой точки мониторинга
-        for location in settings.MONITORING_LOCATIONS:
+        # Запросы по всем точкам мониторинга идут параллельно,
+        # ответы разбираются по мере поступления
+        locations = get_settings().MONITORING_LOCATIONS
+        async for location, air_data, weather_data in iter_locations_data(locations):
             try:
-                # Качество воздуха
-                air_data = await fetch_air_quality_data(
-                    location["lat"],
-                    location["lon"]
-                )
-                
-                # Погода
-                weather_data = await fetch_weather_data(
-                    location["lat"],
-                    location["lon"]
-                )
-                
-                # Комбинируем данные
-                if air_data.get("hourly") and weather_data.get("hourly"):
-                    hourly_air = air_data["hourly"]
-                    hourly_weather = weather_data["hourly"]
-                    
-                    # ✅ ИСПРАВЛЕНИЕ: Берем последние 24 часа (все доступные данные)
-                    num_points = min(len(hourly_air["time"]), 24)
-                    
-                    for i in range(-num_points, 0):  # От -24 до -1
-                        try:
-                            measurement = {
-                                "location_name": location["name"],
-                                "latitude": location["lat"],
-                                "longitude": location["lon"],
-                                "timestamp": datetime.fromisoformat(
-                                    hourly_air["time"][i].replace("Z", "+00:00")
-                                ),
-                                "pm25": hourly_air.get("pm2_5", [None])[i],
-                                "pm10": hourly_air.get("pm10", [None])[i],
-                                "no2": hourly_air.get("nitrogen_dioxide", [None])[i],
-                                "o3": hourly_air.get("ozone", [None])[i],
-                                "co": hourly_air.get("carbon_monoxide", [None])[i],
-                                "temperature": hourly_weather.get("temperature_2m", [None])[i],
-                                "humidity": hourly_weather.get("relative_humidity_2m", [None])[i],
-                            }
-                            collected_data.append(measurement)
-                        except Exception as e:
-                            logger.error(f"Error processing hour {i}: {e}")
-                            continue
-                    
-                    logger.info(f"Collected {num_points} hours of data for {location['name']}")
-            
+                collected_data.extend(self._parse_location(location, air_data, weather_data))
             except Exception as e:
                 logger.error(f"Error collecting data for {location['name']}: {e}")
         
-        # Сохраняем в БД
+        # Сохраняем в БД: все точки одним вызовом - один пакетный INSERT
+        # (или COPY) и один COMMIT на цикл сбора
         saved_count = 0
         if collected_data:
+            # AQI считается при сборе и хранится вместе с измерением
+            attach_aqi(collected_data)
             async for session in get_session():
                 saved_count = await save_measurements(session, collected_data)
         
         message = AIMessage(
-            content=f"✅ Collected {saved_count} measurements from {len(settings.MONITORING_LOCATIONS)} locations (last 24 hours)"
+            content=f"✅ Collected {saved_count} measurements from {len(locations)} locations (last 24 hours)"
         )
         
         return {
@@ -1,18 +1,51 @@
 """Агент прогнозирования качества воздуха"""
 import logging
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict
+from typing import Dict, Sequence
 import numpy as np
 from langchain_core.messages import AIMessage
-from sklearn.linear_model import LinearRegression
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from config import settings
-from data_tools import get_recent_measurements, save_forecast, calculate_aqi
+from data_tools import get_recent_measurements_columnar, calculate_aqi_vec
 from db.database import get_session
+from db.models import Forecast
 
 logger = logging.getLogger(__name__)
 
 
+def linear_forecast(series: Sequence[Sequence[float]], steps: int = 24) -> np.ndarray:
+    """Линейный прогноз (МНК y = a*t + b) сразу для всех рядов
+    
+    Ряды разной длины дополняются NaN до общей длины, наклон и сдвиг
+    считаются в замкнутой форме для всех рядов одновременно. Возвращает
+    значение на шаге `steps` после конца каждого ряда, ограниченное 0..500.
+    """
+    if not series:
+        return np.empty(0)
+    
+    lengths = np.array([len(s) for s in series])
+    Y = np.full((len(series), lengths.max()), np.nan)
+    for i, s in enumerate(series):
+        Y[i, :len(s)] = s
+    
+    valid = ~np.isnan(Y)
+    t = np.arange(Y.shape[1], dtype=np.float64)
+    t_mean = (lengths - 1) / 2.0
+    y_mean = np.nanmean(Y, axis=1)
+    
+    dt = np.where(valid, t - t_mean[:, None], 0.0)
+    dy = np.where(valid, Y - y_mean[:, None], 0.0)
+    slope = (dt * dy).sum(axis=1) / (dt ** 2).sum(axis=1)
+    intercept = y_mean - slope * t_mean
+    
+    predictions = intercept + slope * (lengths - 1 + steps)
+    
+    # Ограничиваем прогноз разумными значениями
+    return np.clip(predictions, 0, 500)
+
+
 class ForecasterAgent:
     """Агент для прогнозирования на 24 часа"""
     
@@ -23,56 +56,52 @@ class ForecasterAgent:
         """Выполнение прогнозирования"""
         logger.info(f"{self.name}: Starting forecast")
         
+        # Одна сессия на весь прогон: чтение измерений и запись прогнозов
+        async for session in get_session():
+            result = await self._forecast(state, session)
+        
+        return result
+    
+    async def _forecast(self, state: Dict, session: AsyncSession) -> Dict:
+        """Построение и сохранение прогнозов в рамках одной сессии"""
         forecasts = []
         
         # Получаем данные за последние 48 часов
-        async for session in get_session():
-            measurements = await get_recent_measurements(session, hours=48)
+        measurements = await get_recent_measurements_columnar(session, hours=48)
         
         if len(measurements) < 10:
             message = AIMessage(content="⚠️ Insufficient data for forecasting")
             return {"messages": state["messages"] + [message], "data": {}}
         
-        # Группируем по локациям
+        # Группируем индексы строк по локациям за один проход
+        row_indices = defaultdict(list)
+        for i, location in enumerate(measurements.location_name):
+            row_indices[location].append(i)
+        
         locations_data = {}
-        for m in measurements:
-            if m.location_name not in locations_data:
-                locations_data[m.location_name] = {
-                    "timestamps": [],
-                    "pm25": [],
-                    "lat": m.latitude,
-                    "lon": m.longitude
-                }
-            locations_data[m.location_name]["timestamps"].append(m.timestamp)
-            locations_data[m.location_name]["pm25"].append(m.pm25 or 0)
+        for location, indices in row_indices.items():
+            locations_data[location] = {
+                "timestamps": measurements.timestamp[indices],
+                "pm25": np.nan_to_num(measurements.pm25[indices]),  # NULL -> 0
+                "lat": float(measurements.latitude[indices[0]]),
+                "lon": float(measurements.longitude[indices[0]]),
+            }
+        
+        # Прогнозируем для всех локаций одним векторным проходом
+        locations = [loc for loc, data in locations_data.items() if len(data["pm25"]) >= 5]
+        predictions = linear_forecast([locations_data[loc]["pm25"] for loc in locations], steps=24)
+        aqi_values = calculate_aqi_vec(predictions)
+        forecast_time = datetime.utcnow() + timedelta(hours=24)
         
-        # Прогнозируем для каждой локации
-        for location, data in locations_data.items():
-            if len(data["pm25"]) < 5:
-                continue
+        rows = []
+        for location, prediction, aqi in zip(locations, predictions, aqi_values):
+            data = locations_data[location]
             
             try:
-                # Простой линейный прогноз
-                X = np.array(range(len(data["pm25"]))).reshape(-1, 1)
-                y = np.array(data["pm25"])
-                
-                model = LinearRegression()
-                model.fit(X, y)
-                
-                # Прогноз на 24 часа вперед
-                future_steps = 24
-                future_X = np.array(range(len(data["pm25"]), len(data["pm25"]) + future_steps)).reshape(-1, 1)
-                predictions = model.predict(future_X)
-                
-                # Ограничиваем прогноз разумными значениями
-                predictions = np.clip(predictions, 0, 500)
-                
-                # Сохраняем прогноз
-                forecast_time = datetime.utcnow() + timedelta(hours=24)
-                predicted_pm25 = float(predictions[-1])
-                predicted_aqi = calculate_aqi(predicted_pm25)
+                predicted_pm25 = float(prediction)
+                predicted_aqi = int(aqi)
                 
-                forecast_data = {
+                rows.append({
                     "location_name": location,
                     "latitude": data["lat"],
                     "longitude": data["lon"],
@@ -81,10 +110,7 @@ class ForecasterAgent:
                     "predicted_pm10": predicted_pm25 * 1.5,  # Упрощенная оценка
                     "predicted_aqi": predicted_aqi,
                     "confidence": 0.75,
-                }
-                
-                async for session in get_session():
-                    await save_forecast(session, forecast_data)
+                })
                 
                 forecasts.append({
                     "location": location,
@@ -95,6 +121,16 @@ class ForecasterAgent:
             except Exception as e:
                 logger.error(f"Forecast error for {location}: {e}")
         
+        # Все прогнозы сохраняются одним пакетным INSERT и одним коммитом
+        if rows:
+            try:
+                await session.execute(insert(Forecast), rows)
+                await session.commit()
+            except Exception as e:
+                logger.error(f"Error saving forecasts: {e}")
+                await session.rollback()
+                forecasts = []
+        
         forecast_text = "\n".join([
             f"📍 {f['location']}: PM2.5={f['pm25']:.1f}, AQI={f['aqi']}"
             for f in forecasts
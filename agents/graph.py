@@ -1,17 +1,14 @@
 """LangGraph мультиагентный граф с supervisor"""
 import logging
 from typing import TypedDict, Annotated, Sequence
-from langchain_core.messages import BaseMessage, HumanMessage
-from langchain_groq import ChatGroq
+from langchain_core.messages import BaseMessage
 from langgraph.graph import StateGraph, END
-from langgraph.prebuilt import ToolExecutor
 import operator
 
 from agents.data_collector import DataCollectorAgent
 from agents.analyzer import AnalyzerAgent
 from agents.forecaster import ForecasterAgent
 from agents.alert_agent import AlertAgentWorker
-from config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -24,50 +21,21 @@ class AgentState(TypedDict):
     data: dict
 
 
-def create_supervisor_chain():
-    """Создание supervisor агента для роутинга задач"""
-    llm = ChatGroq(
-        temperature=0,
-        model_name=settings.GROQ_MODEL,
-        groq_api_key=settings.GROQ_API_KEY
-    )
-    
-    system_prompt = """Вы - координатор мультиагентной системы экологического мониторинга.
-    
-Доступные агенты:
-- data_collector: Сбор данных с API (температура, влажность, PM2.5, PM10, NO2, O3, CO)
-- analyzer: Анализ данных (тренды, аномалии, корреляции)
-- forecaster: Прогнозирование на 24 часа
-- alert_agent: Генерация предупреждений при превышении нормативов
+# Роутинг по типу задачи: статическая таблица, LLM для этого не нужен
+ROUTING_MAP = {
+    "collect_data": "data_collector",
+    "analyze": "analyzer",
+    "forecast": "forecaster",
+    "check_alerts": "alert_agent",
+}
 
-Определите, какой агент должен выполнить задачу. Отвечайте ТОЛЬКО названием агента.
 
-Примеры:
-- "собрать данные" -> data_collector
-- "проанализировать тренды" -> analyzer
-- "прогноз на завтра" -> forecaster
-- "проверить превышения" -> alert_agent
-"""
-    
-    def supervisor_node(state: AgentState) -> AgentState:
-        """Supervisor узел для определения следующего агента"""
-        messages = state["messages"]
-        task_type = state.get("task_type", "unknown")
-        
-        # Простой роутинг на основе типа задачи
-        routing_map = {
-            "collect_data": "data_collector",
-            "analyze": "analyzer",
-            "forecast": "forecaster",
-            "check_alerts": "alert_agent",
-        }
-        
-        next_agent = routing_map.get(task_type, "data_collector")
-        
-        logger.info(f"Supervisor routing to: {next_agent}")
-        return {"next_agent": next_agent, "messages": messages, "data": state.get("data", {})}
+def supervisor_node(state: AgentState) -> AgentState:
+    """Supervisor узел для определения следующего агента"""
+    next_agent = ROUTING_MAP.get(state.get("task_type", "unknown"), "data_collector")
     
-    return supervisor_node
+    logger.info(f"Supervisor routing to: {next_agent}")
+    return {"next_agent": next_agent, "messages": state["messages"], "data": state.get("data", {})}
 
 
 def create_agent_graph():
@@ -83,7 +51,7 @@ def create_agent_graph():
     workflow = StateGraph(AgentState)
     
     # Добавляем узлы
-    workflow.add_node("supervisor", create_supervisor_chain())
+    workflow.add_node("supervisor", supervisor_node)
     workflow.add_node("data_collector", data_collector.execute)
     workflow.add_node("analyzer", analyzer.execute)
     workflow.add_node("forecaster", forecaster.execute)
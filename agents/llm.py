@@ -0,0 +1,20 @@
+"""Общий LLM-клиент для агентов"""
+from functools import lru_cache
+from langchain_groq import ChatGroq
+
+from config import get_settings
+
+
+@lru_cache(maxsize=None)
+def get_llm(temperature: float = 0.3) -> ChatGroq:
+    """ChatGroq-клиент, общий для всех агентов с той же температурой
+    
+    Один экземпляр на процесс - HTTP-пул соединений с Groq переиспользуется
+    между запусками агентов.
+    """
+    settings = get_settings()
+    return ChatGroq(
+        temperature=temperature,
+        model_name=settings.GROQ_MODEL,
+        groq_api_key=settings.GROQ_API_KEY
+    )
@@ -1,14 +1,18 @@
 """API endpoints"""
 import logging
+import math
 from typing import List, Optional
 from datetime import datetime, timedelta
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, lambda_stmt, literal_column
 from pydantic import BaseModel
+import orjson
+from fastapi_cache.decorator import cache
 
 from agents.graph import agent_graph
+from backend.cache import DATA_NAMESPACE, invalidate_data_cache
 from db.database import get_session
 from db.models import Measurement, Forecast, Alert, Analysis
 from langchain_core.messages import HumanMessage
@@ -16,6 +20,14 @@ from langchain_core.messages import HumanMessage
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+VALID_TASKS = ["collect_data", "analyze", "forecast", "check_alerts"]
+
+# Прореживание рядов для графиков: не больше RESAMPLE_MAX_POINTS точек на локацию,
+# корзина не меньше часа (Open-Meteo отдает почасовые данные)
+RESAMPLE_MAX_POINTS = 500
+RESAMPLE_MIN_BUCKET_MINUTES = 60
+RESAMPLE_ORIGIN = datetime(2000, 1, 1)
+
 
 class AgentResponse(BaseModel):
     """Response from agent execution"""
@@ -24,6 +36,12 @@ class AgentResponse(BaseModel):
     data: dict
 
 
+class AgentBatchRequest(BaseModel):
+    """Batch of agent tasks to run in one request"""
+    tasks: List[str]
+    location_filter: Optional[str] = None
+
+
 class MeasurementOut(BaseModel):
     """Measurement response schema"""
     id: int
@@ -38,11 +56,26 @@ class MeasurementOut(BaseModel):
     co: Optional[float] = None
     temperature: Optional[float] = None
     humidity: Optional[float] = None
+    aqi: Optional[int] = None
     
     class Config:
         from_attributes = True
 
 
+class MeasurementBucketOut(BaseModel):
+    """Averaged measurements for one location and time bucket"""
+    location_name: str
+    timestamp: datetime
+    pm25: Optional[float] = None
+    pm10: Optional[float] = None
+    no2: Optional[float] = None
+    o3: Optional[float] = None
+    co: Optional[float] = None
+    temperature: Optional[float] = None
+    humidity: Optional[float] = None
+    aqi: Optional[float] = None
+
+
 class ForecastOut(BaseModel):
     """Forecast response schema"""
     id: int
@@ -67,18 +100,84 @@ class AlertOut(BaseModel):
         from_attributes = True
 
 
+def city_pattern(city: str) -> str:
+    """LIKE-шаблон всех точек города ("Москва" -> "Москва%") с экранированием % и _"""
+    return city.replace("/", "//").replace("%", "/%").replace("_", "/_") + "%"
+
+
+def resampled_query(hours: int, location: Optional[str], city: Optional[str], bucket_minutes: Optional[int]):
+    """Запрос средних значений измерений по корзинам времени для каждой локации"""
+    if bucket_minutes is None:
+        bucket_minutes = max(RESAMPLE_MIN_BUCKET_MINUTES, math.ceil(hours * 60 / RESAMPLE_MAX_POINTS))
+    bucket = timedelta(minutes=max(bucket_minutes, 1))
+    cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+    
+    # date_bin (PostgreSQL 14+) округляет время вниз до начала корзины
+    bucket_ts = func.date_bin(bucket, Measurement.timestamp, RESAMPLE_ORIGIN).label("timestamp")
+    query = lambda_stmt(lambda: select(
+        Measurement.location_name,
+        bucket_ts,
+        func.avg(Measurement.pm25).label("pm25"),
+        func.avg(Measurement.pm10).label("pm10"),
+        func.avg(Measurement.no2).label("no2"),
+        func.avg(Measurement.o3).label("o3"),
+        func.avg(Measurement.co).label("co"),
+        func.avg(Measurement.temperature).label("temperature"),
+        func.avg(Measurement.humidity).label("humidity"),
+        func.avg(Measurement.aqi).label("aqi"),
+    ).where(Measurement.timestamp >= cutoff_time))
+    
+    if location:
+        query += lambda s: s.where(Measurement.location_name == location)
+    
+    if city:
+        pattern = city_pattern(city)
+        query += lambda s: s.where(Measurement.location_name.like(pattern, escape="/"))
+    
+    # Группировка по номерам колонок: повторный date_bin в GROUP BY получил бы
+    # свои bind-параметры, и PostgreSQL не счел бы его тем же выражением, а имя
+    # "timestamp" в GROUP BY означало бы исходную колонку, а не корзину
+    return query + (lambda s: s.group_by(literal_column("1"), literal_column("2")).order_by(literal_column("2")))
+
+
+def agent_input(task_type: str, location_filter: Optional[str] = None) -> dict:
+    """Начальное состояние графа для задачи"""
+    return {
+        "messages": [HumanMessage(content=f"Execute {task_type}")],
+        "task_type": task_type,
+        "next_agent": "",
+        "data": {"location_filter": location_filter},
+    }
+
+
+def agent_response(result: dict) -> AgentResponse:
+    """Ответ API по итоговому состоянию графа"""
+    last_message = result["messages"][-1] if result["messages"] else None
+    response_message = last_message.content if last_message else "Task completed"
+    
+    return AgentResponse(
+        status="success",
+        message=response_message,
+        data=result.get("data", {})
+    )
+
+
 @router.get("/data/analyses")
+@cache(expire=300, namespace=DATA_NAMESPACE)
 async def get_analyses(
     hours: int = 168,
+    city: Optional[str] = None,
     session: AsyncSession = Depends(get_session)
 ):
     """Get recent analyses"""
-    from db.models import Analysis
-    
     cutoff = datetime.utcnow() - timedelta(hours=hours)
-    query = select(Analysis).where(
-        Analysis.created_at >= cutoff
-    ).order_by(Analysis.created_at.desc()).limit(100)
+    query = lambda_stmt(lambda: select(Analysis).where(Analysis.created_at >= cutoff))
+    
+    if city:
+        pattern = city_pattern(city)
+        query += lambda s: s.where(Analysis.location_name.like(pattern, escape="/"))
+    
+    query += lambda s: s.order_by(Analysis.created_at.desc()).limit(100)
     
     result = await session.execute(query)
     analyses = result.scalars().all()
@@ -98,54 +197,111 @@ async def get_analyses(
     ]
 
 
-@router.get("/data/measurements", response_model=List[MeasurementOut])
+@router.get("/data/measurements")
 async def get_measurements(
     hours: int = 24,
     location: Optional[str] = None,
-    session: AsyncSession = Depends(get_session)
+    city: Optional[str] = None,
+    fields: Optional[str] = None,
 ):
-    """Get recent measurements"""
+    """Get recent measurements as NDJSON (one MeasurementOut per line)
+    
+    fields - список полей MeasurementOut через запятую; в ответ попадают только они.
+    """
+    include = None
+    if fields:
+        include = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = include - MeasurementOut.model_fields.keys()
+        if unknown:
+            raise HTTPException(400, f"Unknown fields {sorted(unknown)}. Must be among: {list(MeasurementOut.model_fields)}")
+    
+    # lambda_stmt кэширует скомпилированный SQL; значения hours/location
+    # идут в него связанными параметрами
     cutoff_time = datetime.utcnow() - timedelta(hours=hours)
-    query = select(Measurement).where(Measurement.timestamp >= cutoff_time)
+    query = lambda_stmt(lambda: select(Measurement).where(Measurement.timestamp >= cutoff_time))
     
     if location:
-        query = query.where(Measurement.location_name == location)
+        query += lambda s: s.where(Measurement.location_name == location)
     
-    query = query.order_by(Measurement.timestamp.desc()).limit(1000)
-    result = await session.execute(query)
-    measurements = result.scalars().all()
+    if city:
+        pattern = city_pattern(city)
+        query += lambda s: s.where(Measurement.location_name.like(pattern, escape="/"))
+    
+    query += lambda s: s.order_by(Measurement.timestamp.desc()).limit(1000)
+    
+    async def rows():
+        # Сессия открывается в генераторе: зависимость с yield закрылась бы
+        # до начала отправки потокового ответа
+        async for session in get_session():
+            result = await session.stream_scalars(query)
+            async for m in result:
+                yield orjson.dumps(MeasurementOut.model_validate(m).model_dump(include=include)) + b"\n"
+    
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+@router.get("/data/measurements_resampled", response_model=List[MeasurementBucketOut])
+@cache(expire=60, namespace=DATA_NAMESPACE)
+async def get_measurements_resampled(
+    hours: int = 24,
+    location: Optional[str] = None,
+    city: Optional[str] = None,
+    bucket_minutes: Optional[int] = None,
+    session: AsyncSession = Depends(get_session)
+):
+    """Get recent measurements averaged into time buckets (for charts)"""
+    result = await session.execute(resampled_query(hours, location, city, bucket_minutes))
+    
+    return [MeasurementBucketOut.model_validate(row._mapping) for row in result]
+
+
+@router.get("/data/cities", response_model=List[str])
+@cache(expire=300, namespace=DATA_NAMESPACE)
+async def get_cities(
+    hours: int = 1,
+    session: AsyncSession = Depends(get_session)
+):
+    """Get cities that have recent measurements"""
+    cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+    query = lambda_stmt(lambda: select(Measurement.location_name).where(
+        Measurement.timestamp >= cutoff_time
+    ).distinct())
+    locations = (await session.execute(query)).scalars().all()
     
-    return measurements
+    # "Москва (Центр)" -> "Москва"
+    return sorted({name.split(" (")[0] for name in locations})
 
 
 @router.get("/data/forecasts", response_model=List[ForecastOut])
+@cache(expire=300, namespace=DATA_NAMESPACE)
 async def get_forecasts(
     session: AsyncSession = Depends(get_session)
 ):
     """Get recent forecasts"""
-    query = select(Forecast).order_by(Forecast.created_at.desc()).limit(100)
+    query = lambda_stmt(lambda: select(Forecast).order_by(Forecast.created_at.desc()).limit(100))
     result = await session.execute(query)
     forecasts = result.scalars().all()
     
-    return forecasts
+    return [ForecastOut.model_validate(f) for f in forecasts]
 
 
 @router.get("/data/alerts", response_model=List[AlertOut])
+@cache(expire=300, namespace=DATA_NAMESPACE)
 async def get_alerts(
     active_only: bool = True,
     session: AsyncSession = Depends(get_session)
 ):
     """Get alerts"""
-    query = select(Alert)
+    query = lambda_stmt(lambda: select(Alert))
     
     if active_only:
-        query = query.where(Alert.is_active == True)
+        query += lambda s: s.where(Alert.is_active.is_(True))
     
-    query = query.order_by(Alert.created_at.desc()).limit(100)
+    query += lambda s: s.order_by(Alert.created_at.desc()).limit(100)
     result = await session.execute(query)
     alerts = result.scalars().all()
     
-    return alerts
+    return [AlertOut.model_validate(a) for a in alerts]
 
 
 @router.post("/run-agent/{task_type}", response_model=AgentResponse)
@@ -154,58 +310,76 @@ async def run_agent(
     location_filter: Optional[str] = None  # ✅ НОВЫЙ параметр
 ):
     """Execute agent task"""
-    valid_tasks = ["collect_data", "analyze", "forecast", "check_alerts"]
-    
-    if task_type not in valid_tasks:
-        raise HTTPException(400, f"Invalid task. Must be one of: {valid_tasks}")
+    if task_type not in VALID_TASKS:
+        raise HTTPException(400, f"Invalid task. Must be one of: {VALID_TASKS}")
     
     try:
         logger.info(f"Running agent task: {task_type} with location_filter: {location_filter}")
         
         # Запускаем граф
-        result = await agent_graph.ainvoke({
-            "messages": [HumanMessage(content=f"Execute {task_type}")],
-            "task_type": task_type,
-            "next_agent": "",
-            "data": {"location_filter": location_filter} 
-        })
+        result = await agent_graph.ainvoke(agent_input(task_type, location_filter))
         
-        # Извлекаем результат
-        last_message = result["messages"][-1] if result["messages"] else None
-        response_message = last_message.content if last_message else "Task completed"
+        # Агенты записали новые данные - закэшированные ответы устарели
+        await invalidate_data_cache()
         
-        return AgentResponse(
-            status="success",
-            message=response_message,
-            data=result.get("data", {})
-        )
+        return agent_response(result)
     
     except Exception as e:
         logger.error(f"Agent execution error: {e}", exc_info=True)
         raise HTTPException(500, f"Agent execution failed: {str(e)}")
 
 
+@router.post("/run-agents", response_model=List[AgentResponse])
+async def run_agents(request: AgentBatchRequest):
+    """Execute several agent tasks concurrently
+    
+    Tasks run in parallel via agent_graph.abatch, so they must not depend
+    on each other's output (e.g. analyze does not wait for collect_data).
+    """
+    invalid = [t for t in request.tasks if t not in VALID_TASKS]
+    if invalid or not request.tasks:
+        raise HTTPException(400, f"Invalid tasks {invalid}. Must be one of: {VALID_TASKS}")
+    
+    try:
+        logger.info(f"Running agent tasks: {request.tasks} with location_filter: {request.location_filter}")
+        
+        results = await agent_graph.abatch(
+            [agent_input(task_type, request.location_filter) for task_type in request.tasks]
+        )
+        
+        await invalidate_data_cache()
+        
+        return [agent_response(result) for result in results]
+    
+    except Exception as e:
+        logger.error(f"Agent batch execution error: {e}", exc_info=True)
+        raise HTTPException(500, f"Agent execution failed: {str(e)}")
+
 
 @router.get("/data/current")
+@cache(expire=60, namespace=DATA_NAMESPACE)
 async def get_current_status(session: AsyncSession = Depends(get_session)):
     """Get current status summary"""
-    # Latest measurements
+    # Считаем и выбираем уникальные локации на стороне БД,
+    # вместо загрузки всех измерений за час
     cutoff = datetime.utcnow() - timedelta(hours=1)
-    measurements_query = select(Measurement).where(
+    count_query = lambda_stmt(lambda: select(func.count()).select_from(Measurement).where(
         Measurement.timestamp >= cutoff
-    ).order_by(Measurement.timestamp.desc())
-    
-    measurements_result = await session.execute(measurements_query)
-    recent_measurements = measurements_result.scalars().all()
+    ))
+    locations_query = lambda_stmt(lambda: select(Measurement.location_name).where(
+        Measurement.timestamp >= cutoff
+    ).distinct())
+    alerts_count_query = lambda_stmt(lambda: select(func.count()).select_from(Alert).where(Alert.is_active.is_(True)))
     
-    # Active alerts
-    alerts_query = select(Alert).where(Alert.is_active == True)
-    alerts_result = await session.execute(alerts_query)
-    active_alerts = alerts_result.scalars().all()
+    # Запросы идут последовательно: AsyncSession не допускает
+    # параллельных операций на одном соединении
+    measurements_count = (await session.execute(count_query)).scalar_one()
+    locations = (await session.execute(locations_query)).scalars().all()
+    active_alerts_count = (await session.execute(alerts_count_query)).scalar_one()
     
     return {
         "timestamp": datetime.utcnow().isoformat(),
-        "measurements_count": len(recent_measurements),
-        "active_alerts_count": len(active_alerts),
-        "locations": list(set(m.location_name for m in recent_measurements))
+        "measurements_count": measurements_count,
+        "active_alerts_count": active_alerts_count,
+        "locations": list(locations)
     }
@@ -0,0 +1,57 @@
+"""Кэширование ответов API (Redis через fastapi-cache2)"""
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from redis import asyncio as aioredis
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.requests import Request
+from starlette.responses import Response
+
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Пространство имен кэша для GET /data/*
+DATA_NAMESPACE = "data"
+
+
+def query_key_builder(
+    func: Callable[..., Any],
+    namespace: str = "",
+    *,
+    request: Optional[Request] = None,
+    response: Optional[Response] = None,
+    args: Tuple[Any, ...],
+    kwargs: Dict[str, Any],
+) -> str:
+    """Ключ кэша по параметрам запроса (сессия БД в ключ не входит)"""
+    params = sorted(
+        (name, value) for name, value in kwargs.items()
+        if not isinstance(value, AsyncSession)
+    )
+    digest = hashlib.md5(f"{func.__module__}:{func.__name__}:{params}".encode()).hexdigest()
+    return f"{namespace}:{digest}"
+
+
+def init_cache():
+    """Инициализация кэша: Redis, либо память процесса, если REDIS_URL не задан"""
+    redis_url = get_settings().REDIS_URL
+    if redis_url:
+        redis = aioredis.from_url(redis_url)
+        FastAPICache.init(RedisBackend(redis), prefix="eco", key_builder=query_key_builder)
+        logger.info("Response cache: Redis")
+    else:
+        FastAPICache.init(InMemoryBackend(), prefix="eco", key_builder=query_key_builder)
+        logger.info("Response cache: in-memory")
+
+
+async def invalidate_data_cache():
+    """Сброс закэшированных ответов /data/* после работы агентов"""
+    try:
+        await FastAPICache.clear(namespace=DATA_NAMESPACE)
+    except Exception as e:
+        logger.warning(f"Failed to clear response cache: {e}")
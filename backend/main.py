@@ -3,14 +3,17 @@ import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from backend.api import router
+from backend.cache import init_cache
 from db.database import init_db
-from config import settings
+from data_tools import init_http_client, close_http_client
+from config import get_settings
 
 # Настройка логирования
 logging.basicConfig(
-    level=settings.LOG_LEVEL,
+    level=get_settings().LOG_LEVEL,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -21,7 +24,10 @@ async def lifespan(app: FastAPI):
     """Lifecycle events"""
     logger.info("Starting Eco Monitor Backend")
     await init_db()
+    init_http_client()
+    init_cache()
     yield
+    await close_http_client()
     logger.info("Shutting down Eco Monitor Backend")
 
 
@@ -29,7 +35,8 @@ app = FastAPI(
     title="Eco Monitor API",
     description="Мультиагентная система экологического мониторинга",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # CORS
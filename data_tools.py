@@ -1,17 +1,68 @@
 """Инструменты для агентов - взаимодействие с API и БД"""
+import asyncio
 import logging
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Sequence, Tuple
 import httpx
 import numpy as np
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, text, Row, Select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from db.models import Measurement, Forecast, Alert
-from config import settings
+from db.models import Measurement, Forecast, Alert, measurements_staging
 
 logger = logging.getLogger(__name__)
 
+# Максимум одновременных запросов к Open-Meteo
+FETCH_CONCURRENCY = 20
+
+# Строк в одном многострочном INSERT (лимит параметров asyncpg - 32767)
+INSERT_BATCH_SIZE = 1000
+
+# С какого числа строк измерения грузятся через COPY в staging-таблицу
+COPY_THRESHOLD = 100
+
+# Размер порции при потоковом чтении измерений
+STREAM_BATCH_SIZE = 1000
+
+# Поля измерений, которые используют агенты
+MEASUREMENT_FIELDS = (
+    Measurement.location_name,
+    Measurement.latitude,
+    Measurement.longitude,
+    Measurement.timestamp,
+    Measurement.pm25,
+    Measurement.pm10,
+    Measurement.no2,
+    Measurement.temperature,
+)
+
+
+# Общий HTTP-клиент для Open-Meteo: keep-alive и HTTP/2 вместо нового
+# TCP+TLS соединения на каждый запрос. Создается в lifespan приложения.
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def init_http_client() -> httpx.AsyncClient:
+    """Создание общего HTTP-клиента (если он еще не создан)"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=30.0,
+            http2=True,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    """Закрытие общего HTTP-клиента"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
 async def fetch_air_quality_data(lat: float, lon: float) -> Dict:
     """Получение данных о качестве воздуха через Open-Meteo API"""
@@ -25,10 +76,9 @@ async def fetch_air_quality_data(lat: float, lon: float) -> Dict:
     }
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            return response.json()
+        response = await init_http_client().get(url, params=params)
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
         logger.error(f"Error fetching air quality: {e}")
         return {}
@@ -46,59 +96,177 @@ async def fetch_weather_data(lat: float, lon: float) -> Dict:
     }
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            return response.json()
+        response = await init_http_client().get(url, params=params)
+        response.raise_for_status()
+        return response.json()
     except Exception as e:
         logger.error(f"Error fetching weather: {e}")
         return {}
 
 
+async def _fetch_location(location: Dict, semaphore: asyncio.Semaphore) -> Tuple[Dict, Dict]:
+    """Качество воздуха и погода для одной точки; каждый запрос проходит через семафор"""
+    async def limited(fetch) -> Dict:
+        async with semaphore:
+            return await fetch(location["lat"], location["lon"])
+    
+    return await asyncio.gather(limited(fetch_air_quality_data), limited(fetch_weather_data))
+
+
+async def iter_locations_data(locations: Sequence[Dict]) -> AsyncIterator[Tuple[Dict, Dict, Dict]]:
+    """Параллельная загрузка данных по точкам с выдачей по мере готовности
+    
+    Возвращает (location, air_data, weather_data) в порядке завершения запросов,
+    чтобы разбор ответов шел, пока остальные запросы еще выполняются.
+    """
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    
+    async def located(location: Dict) -> Tuple[Dict, Dict, Dict]:
+        air_data, weather_data = await _fetch_location(location, semaphore)
+        return location, air_data, weather_data
+    
+    for next_done in asyncio.as_completed([located(location) for location in locations]):
+        yield await next_done
+
+
+async def _copy_measurements(session: AsyncSession, data: List[Dict]) -> int:
+    """Загрузка измерений через COPY в UNLOGGED staging и INSERT ... SELECT"""
+    columns = [c.name for c in measurements_staging.columns]
+    created_at = datetime.utcnow()
+    records = [
+        tuple(created_at if name == "created_at" else row.get(name) for name in columns)
+        for row in data
+    ]
+    
+    # TRUNCATE берет эксклюзивную блокировку до конца транзакции, поэтому
+    # параллельные загрузки не смешивают строки в staging
+    await session.execute(text("TRUNCATE measurements_staging"))
+    
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        "measurements_staging", records=records, columns=columns
+    )
+    
+    stmt = (
+        pg_insert(Measurement)
+        .from_select(columns, select(measurements_staging))
+        .on_conflict_do_nothing(index_elements=["location_name", "timestamp"])
+        .returning(Measurement.id)
+    )
+    result = await session.execute(stmt)
+    saved_count = len(result.all())
+    
+    await session.execute(text("TRUNCATE measurements_staging"))
+    return saved_count
+
+
 async def save_measurements(session: AsyncSession, data: List[Dict]) -> int:
-    """Сохранение измерений в БД"""
+    """Сохранение измерений в БД
+    
+    Пакетный INSERT ... ON CONFLICT DO NOTHING: дубликаты по
+    (location_name, timestamp) пропускаются самой БД, без SELECT на каждую строку.
+    Большие пакеты идут через COPY в UNLOGGED staging-таблицу.
+    """
+    if len(data) > COPY_THRESHOLD:
+        saved_count = await _copy_measurements(session, data)
+        await session.commit()
+        return saved_count
     
     saved_count = 0
-    for item in data:
-        try:
-            # Проверяем, не существует ли уже такая запись
-            existing = await session.execute(
-                select(Measurement).where(
-                    Measurement.location_name == item["location_name"],
-                    Measurement.timestamp == item["timestamp"]
-                )
-            )
-            
-            if existing.scalars().first():
-                logger.debug(f"Skipping duplicate: {item['location_name']} at {item['timestamp']}")
-                continue
-            
-            measurement = Measurement(**item)
-            session.add(measurement)
-            saved_count += 1
-        except Exception as e:
-            logger.error(f"Error saving measurement: {e}")
+    for start in range(0, len(data), INSERT_BATCH_SIZE):
+        stmt = (
+            pg_insert(Measurement)
+            .values(data[start:start + INSERT_BATCH_SIZE])
+            .on_conflict_do_nothing(index_elements=["location_name", "timestamp"])
+            .returning(Measurement.id)
+        )
+        result = await session.execute(stmt)
+        saved_count += len(result.all())
     
     await session.commit()
     return saved_count
 
 
+def _recent_measurements_query(
+    hours: int,
+    location_name: Optional[str] = None,
+    location_prefix: Optional[str] = None
+) -> Select:
+    """SELECT последних измерений с полями MEASUREMENT_FIELDS"""
+    cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+    query = select(*MEASUREMENT_FIELDS).where(Measurement.timestamp >= cutoff_time)
+    
+    if location_name:
+        query = query.where(Measurement.location_name == location_name)
+    
+    # Все точки города: "Москва" -> "Москва (Центр)", "Москва (Север)", ...
+    if location_prefix:
+        query = query.where(Measurement.location_name.startswith(location_prefix, autoescape=True))
+    
+    return query.order_by(Measurement.timestamp.desc()).execution_options(yield_per=STREAM_BATCH_SIZE)
+
 
 async def get_recent_measurements(
     session: AsyncSession,
     hours: int = 168,
-    location_name: Optional[str] = None
-) -> List[Measurement]:
-    """Получение последних измерений из БД"""
-    cutoff_time = datetime.utcnow() - timedelta(hours=hours)
-    query = select(Measurement).where(Measurement.timestamp >= cutoff_time)
+    location_name: Optional[str] = None,
+    location_prefix: Optional[str] = None
+) -> AsyncIterator[Row]:
+    """Потоковое получение последних измерений из БД
     
-    if location_name:
-        query = query.where(Measurement.location_name == location_name)
+    Строки Core (без ORM-объектов) с полями, которые читают агенты, выбираются
+    серверным курсором порциями по STREAM_BATCH_SIZE, а не одним списком.
+    """
+    result = await session.stream(_recent_measurements_query(hours, location_name, location_prefix))
+    async for row in result:
+        yield row
+
+
+@dataclass
+class MeasurementBatch:
+    """Измерения в колоночном виде: по одному массиву NumPy на поле
     
-    query = query.order_by(Measurement.timestamp.desc())
-    result = await session.execute(query)
-    return result.scalars().all()
+    Числовые поля - float64, отсутствующие значения (NULL) - NaN.
+    """
+    location_name: np.ndarray  # object
+    latitude: np.ndarray
+    longitude: np.ndarray
+    timestamp: np.ndarray  # datetime64[s]
+    pm25: np.ndarray
+    pm10: np.ndarray
+    no2: np.ndarray
+    temperature: np.ndarray
+    
+    def __len__(self) -> int:
+        return len(self.location_name)
+
+
+async def get_recent_measurements_columnar(
+    session: AsyncSession,
+    hours: int = 168,
+    location_prefix: Optional[str] = None
+) -> MeasurementBatch:
+    """Получение последних измерений из БД в виде MeasurementBatch"""
+    result = await session.stream(_recent_measurements_query(hours, location_prefix=location_prefix))
+    
+    # Порции строк сразу раскладываем по колонкам
+    columns = [[] for _ in MEASUREMENT_FIELDS]
+    async for partition in result.partitions():
+        for column, values in zip(columns, zip(*partition)):
+            column.extend(values)
+    names, lats, lons, timestamps, pm25, pm10, no2, temperature = columns
+    
+    return MeasurementBatch(
+        location_name=np.array(names, dtype=object),
+        latitude=np.array(lats, dtype=np.float64),
+        longitude=np.array(lons, dtype=np.float64),
+        timestamp=np.array(timestamps, dtype="datetime64[s]"),
+        pm25=np.array(pm25, dtype=np.float64),
+        pm10=np.array(pm10, dtype=np.float64),
+        no2=np.array(no2, dtype=np.float64),
+        temperature=np.array(temperature, dtype=np.float64),
+    )
 
 
 async def save_forecast(session: AsyncSession, forecast_data: Dict) -> Forecast:
@@ -123,7 +291,7 @@ async def get_active_alerts(session: AsyncSession) -> List[Alert]:
     """Получение активных алертов"""
     query = select(Alert).where(
         and_(
-            Alert.is_active == True,
+            Alert.is_active.is_(True),
             Alert.created_at >= datetime.utcnow() - timedelta(hours=24)
         )
     ).order_by(Alert.created_at.desc())
@@ -132,29 +300,47 @@ async def get_active_alerts(session: AsyncSession) -> List[Alert]:
     return result.scalars().all()
 
 
+# Границы сегментов PM2.5 -> AQI (EPA); единственное место, где они заданы
+_AQI_BP_LO = np.array([0.0, 12.1, 35.5, 55.5, 150.5, 250.5])
+_AQI_BP_HI = np.array([12.0, 35.4, 55.4, 150.4, 250.4, 500.4])
+_AQI_LO = np.array([0.0, 50.0, 100.0, 150.0, 200.0, 300.0])
+_AQI_HI = np.array([50.0, 100.0, 150.0, 200.0, 300.0, 500.0])
+_AQI_SLOPE = (_AQI_HI - _AQI_LO) / (_AQI_BP_HI - _AQI_BP_LO)
+
+
+def calculate_aqi_vec(pm25: np.ndarray) -> np.ndarray:
+    """Векторный расчет AQI для массива PM2.5 (с точностью до 0.1 μg/m³)"""
+    # Квантизация до 0.1 μg/m³, как в таблице границ
+    pm25 = np.round(np.asarray(pm25, dtype=np.float64) * 10) / 10
+    # Индекс сегмента; значения выше последней границы экстраполируются по последнему
+    idx = np.minimum(np.searchsorted(_AQI_BP_HI, pm25), len(_AQI_BP_HI) - 1)
+    aqi = _AQI_SLOPE[idx] * (pm25 - _AQI_BP_LO[idx]) + _AQI_LO[idx]
+    return aqi.astype(np.int64)
+
+
 def calculate_aqi(pm25: float) -> int:
-    """Упрощенный расчет AQI на основе PM2.5"""
-    if pm25 <= 12.0:
-        return int((50 / 12.0) * pm25)
-    elif pm25 <= 35.4:
-        return int(50 + ((100 - 50) / (35.4 - 12.1)) * (pm25 - 12.1))
-    elif pm25 <= 55.4:
-        return int(100 + ((150 - 100) / (55.4 - 35.5)) * (pm25 - 35.5))
-    elif pm25 <= 150.4:
-        return int(150 + ((200 - 150) / (150.4 - 55.5)) * (pm25 - 55.5))
-    elif pm25 <= 250.4:
-        return int(200 + ((300 - 200) / (250.4 - 150.5)) * (pm25 - 150.5))
-    else:
-        return int(300 + ((500 - 300) / (500.4 - 250.5)) * (pm25 - 250.5))
+    """Упрощенный расчет AQI на основе PM2.5 для одного значения"""
+    return int(calculate_aqi_vec(np.array([pm25]))[0])
 
 
-def analyze_trend(values: List[float]) -> str:
+def _trend_slope(values: np.ndarray) -> float:
+    """Наклон линейного тренда для непрерывного массива float64
+    
+    МНК в замкнутой форме по оси 0..n-1 - одно скалярное произведение
+    вместо SVD внутри np.polyfit.
+    """
+    n = len(values)
+    i = np.arange(n, dtype=np.float64)
+    i_sum = i.sum()
+    return (n * (i @ values) - i_sum * values.sum()) / (n * (i @ i) - i_sum ** 2)
+
+
+def analyze_trend(values: Sequence[float]) -> str:
     """Анализ тренда временного ряда"""
     if len(values) < 2:
         return "insufficient_data"
     
-    values_array = np.array(values)
-    slope = np.polyfit(range(len(values)), values_array, 1)[0]
+    slope = _trend_slope(np.ascontiguousarray(values, dtype=np.float64))
     
     if slope > 0.5:
         return "increasing"
@@ -164,19 +350,23 @@ def analyze_trend(values: List[float]) -> str:
         return "stable"
 
 
-def detect_anomalies(values: List[float], threshold: float = 2.0) -> List[int]:
-    """Обнаружение аномалий методом z-score"""
-    if len(values) < 3:
-        return []
-    
-    values_array = np.array(values)
-    mean = np.mean(values_array)
-    std = np.std(values_array)
+def _anomaly_indices(values: np.ndarray, threshold: float) -> np.ndarray:
+    """Индексы значений с |z-score| > threshold для непрерывного массива float64"""
+    # Один буфер отклонений служит и для дисперсии, и для сравнения:
+    # |x - mean| > threshold * std вместо отдельного массива z-score
+    deviations = values - values.mean()
+    std = np.sqrt(np.dot(deviations, deviations) / len(values))
     
     if std == 0:
-        return []
+        return np.empty(0, dtype=np.int64)
     
-    z_scores = np.abs((values_array - mean) / std)
-    anomaly_indices = np.where(z_scores > threshold)[0].tolist()
+    np.abs(deviations, out=deviations)
+    return np.flatnonzero(deviations > threshold * std)
+
+
+def detect_anomalies(values: Sequence[float], threshold: float = 2.0) -> List[int]:
+    """Обнаружение аномалий методом z-score"""
+    if len(values) < 3:
+        return []
     
-    return anomaly_indices
+    return _anomaly_indices(np.ascontiguousarray(values, dtype=np.float64), threshold).tolist()
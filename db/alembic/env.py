@@ -6,7 +6,7 @@ from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import async_engine_from_config
 from alembic import context
 
-from config import settings
+from config import get_settings
 from db.database import Base
 from db.models import Measurement, Forecast, Alert
 
@@ -14,7 +14,7 @@ from db.models import Measurement, Forecast, Alert
 config = context.config
 
 # Переопределяем URL из .env
-config.set_main_option("sqlalchemy.url", settings.DATABASE_URL)
+config.set_main_option("sqlalchemy.url", get_settings().DATABASE_URL)
 
 # Logging setup
 if config.config_file_name is not None:
@@ -48,7 +48,7 @@ def do_run_migrations(connection: Connection) -> None:
 async def run_async_migrations() -> None:
     """Run migrations in 'online' mode with async engine."""
     configuration = config.get_section(config.config_ini_section)
-    configuration["sqlalchemy.url"] = settings.DATABASE_URL
+    configuration["sqlalchemy.url"] = get_settings().DATABASE_URL
     
     connectable = async_engine_from_config(
         configuration,
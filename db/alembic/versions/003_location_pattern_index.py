@@ -0,0 +1,27 @@
+"""add_location_pattern_index
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'idx_location_name_pattern',
+        'measurements',
+        ['location_name'],
+        postgresql_ops={'location_name': 'text_pattern_ops'},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_location_name_pattern', table_name='measurements')
@@ -0,0 +1,30 @@
+"""add_unique_measurement
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Удаляем возможные дубликаты, оставляя самую раннюю запись
+    op.execute("""
+        DELETE FROM measurements a
+        USING measurements b
+        WHERE a.id > b.id
+          AND a.location_name = b.location_name
+          AND a.timestamp = b.timestamp
+    """)
+    op.create_unique_constraint('unique_measurement', 'measurements', ['location_name', 'timestamp'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('unique_measurement', 'measurements', type_='unique')
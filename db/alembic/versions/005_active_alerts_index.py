@@ -0,0 +1,35 @@
+"""add_active_alerts_index
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # CONCURRENTLY нельзя выполнять внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_alerts_active_created',
+            'alerts',
+            [sa.text('created_at DESC')],
+            postgresql_where=sa.text('is_active'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_alerts_active_created',
+            table_name='alerts',
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,38 @@
+"""add_measurements_staging
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # UNLOGGED: не пишет WAL, содержимое после сбоя теряется - для staging это нормально
+    op.create_table(
+        'measurements_staging',
+        sa.Column('location_name', sa.String(100), nullable=False),
+        sa.Column('latitude', sa.Float(), nullable=False),
+        sa.Column('longitude', sa.Float(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('pm25', sa.Float()),
+        sa.Column('pm10', sa.Float()),
+        sa.Column('no2', sa.Float()),
+        sa.Column('o3', sa.Float()),
+        sa.Column('co', sa.Float()),
+        sa.Column('temperature', sa.Float()),
+        sa.Column('humidity', sa.Float()),
+        sa.Column('created_at', sa.DateTime()),
+        prefixes=['UNLOGGED'],
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('measurements_staging')
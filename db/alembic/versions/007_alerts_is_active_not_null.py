@@ -0,0 +1,57 @@
+"""alerts_is_active_not_null
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute("UPDATE alerts SET is_active = false WHERE is_active IS NULL")
+    op.alter_column(
+        'alerts',
+        'is_active',
+        existing_type=sa.Boolean(),
+        nullable=False,
+        server_default=sa.text('true'),
+    )
+    
+    # Предикат частичного индекса приводим к виду, который генерирует
+    # Alert.is_active.is_(True), чтобы планировщик сопоставлял их напрямую
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_alerts_active_created', table_name='alerts', postgresql_concurrently=True)
+        op.create_index(
+            'ix_alerts_active_created',
+            'alerts',
+            [sa.text('created_at DESC')],
+            postgresql_where=sa.text('is_active IS TRUE'),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_alerts_active_created', table_name='alerts', postgresql_concurrently=True)
+        op.create_index(
+            'ix_alerts_active_created',
+            'alerts',
+            [sa.text('created_at DESC')],
+            postgresql_where=sa.text('is_active'),
+            postgresql_concurrently=True,
+        )
+    
+    op.alter_column(
+        'alerts',
+        'is_active',
+        existing_type=sa.Boolean(),
+        nullable=True,
+        server_default=None,
+    )
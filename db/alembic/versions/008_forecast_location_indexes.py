@@ -0,0 +1,24 @@
+"""add_forecast_location_indexes
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '008'
+down_revision = '007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('idx_forecast_location_time', 'forecasts', ['location_name', 'forecast_time'])
+    op.create_index('idx_forecast_location_created', 'forecasts', ['location_name', sa.text('created_at DESC')])
+
+
+def downgrade() -> None:
+    op.drop_index('idx_forecast_location_created', table_name='forecasts')
+    op.drop_index('idx_forecast_location_time', table_name='forecasts')
@@ -0,0 +1,32 @@
+"""add_alert_active_location_index
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '009'
+down_revision = '008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_alert_active_loc_created',
+            'alerts',
+            ['is_active', 'location_name', sa.text('created_at DESC')],
+            postgresql_concurrently=True,
+        )
+        # Ведущая колонка составного индекса покрывает выборки только по is_active
+        op.drop_index('ix_alerts_is_active', table_name='alerts', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_alerts_is_active', 'alerts', ['is_active'], postgresql_concurrently=True)
+        op.drop_index('idx_alert_active_loc_created', table_name='alerts', postgresql_concurrently=True)
@@ -0,0 +1,37 @@
+"""measurement_covering_index
+
+Revision ID: 010
+Revises: 009
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '010'
+down_revision = '009'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_measurement_loc_ts_cover',
+            'measurements',
+            ['location_name', sa.text('timestamp DESC')],
+            postgresql_include=['pm25', 'pm10', 'latitude', 'longitude', 'temperature', 'humidity'],
+            postgresql_concurrently=True,
+        )
+        op.drop_index('idx_location_timestamp', table_name='measurements', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_location_timestamp',
+            'measurements',
+            ['location_name', 'timestamp'],
+            postgresql_concurrently=True,
+        )
+        op.drop_index('idx_measurement_loc_ts_cover', table_name='measurements', postgresql_concurrently=True)
@@ -0,0 +1,38 @@
+"""alert_active_partial_index
+
+Revision ID: 011
+Revises: 010
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '011'
+down_revision = '010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_alert_active_partial',
+            'alerts',
+            ['location_name', sa.text('created_at DESC')],
+            postgresql_where=sa.text('is_active IS TRUE'),
+            postgresql_concurrently=True,
+        )
+        # Полный составной индекс хранит и закрытые алерты — частичный его заменяет
+        op.drop_index('idx_alert_active_loc_created', table_name='alerts', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_alert_active_loc_created',
+            'alerts',
+            ['is_active', 'location_name', sa.text('created_at DESC')],
+            postgresql_concurrently=True,
+        )
+        op.drop_index('idx_alert_active_partial', table_name='alerts', postgresql_concurrently=True)
@@ -0,0 +1,33 @@
+"""measurement_timestamp_brin
+
+Revision ID: 012
+Revises: 011
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '012'
+down_revision = '011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_measurement_ts_brin',
+            'measurements',
+            ['timestamp'],
+            postgresql_using='brin',
+            postgresql_with={'pages_per_range': 32},
+            postgresql_concurrently=True,
+        )
+        op.drop_index('ix_measurements_timestamp', table_name='measurements', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_measurements_timestamp', 'measurements', ['timestamp'], postgresql_concurrently=True)
+        op.drop_index('idx_measurement_ts_brin', table_name='measurements', postgresql_concurrently=True)
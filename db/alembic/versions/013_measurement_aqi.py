@@ -0,0 +1,39 @@
+"""add_measurement_aqi
+
+Revision ID: 013
+Revises: 012
+Create Date: 2026-10-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '013'
+down_revision = '012'
+branch_labels = None
+depends_on = None
+
+# Кусочно-линейный AQI по PM2.5 (как calculate_aqi_vec и границы _AQI_BP_* в data_tools) для заполнения старых строк
+BACKFILL_AQI = """
+UPDATE measurements SET aqi = trunc(CASE
+    WHEN p <= 12.0 THEN 50.0 / 12.0 * p
+    WHEN p <= 35.4 THEN 50.0 / 23.3 * (p - 12.1) + 50
+    WHEN p <= 55.4 THEN 50.0 / 19.9 * (p - 35.5) + 100
+    WHEN p <= 150.4 THEN 50.0 / 94.9 * (p - 55.5) + 150
+    WHEN p <= 250.4 THEN 100.0 / 99.9 * (p - 150.5) + 200
+    ELSE 200.0 / 249.9 * (p - 250.5) + 300
+END)
+FROM (SELECT id AS m_id, round(pm25::numeric, 1) AS p FROM measurements WHERE pm25 IS NOT NULL) AS src
+WHERE measurements.id = src.m_id
+"""
+
+
+def upgrade() -> None:
+    op.add_column('measurements', sa.Column('aqi', sa.Integer(), nullable=True))
+    op.add_column('measurements_staging', sa.Column('aqi', sa.Integer(), nullable=True))
+    op.execute(BACKFILL_AQI)
+
+
+def downgrade() -> None:
+    op.drop_column('measurements_staging', 'aqi')
+    op.drop_column('measurements', 'aqi')
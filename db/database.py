@@ -4,17 +4,23 @@ from typing import AsyncGenerator
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 
-from config import settings
+from config import get_settings
 
 logger = logging.getLogger(__name__)
 
 # Создаем async engine
 engine = create_async_engine(
-    settings.DATABASE_URL,
+    get_settings().DATABASE_URL,
     echo=False,
     pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
+    pool_size=20,
+    max_overflow=40,
+    pool_recycle=3600,
+    # Сессии и так завершают транзакцию при закрытии - лишний ROLLBACK
+    # при возврате соединения в пул не нужен
+    pool_reset_on_return=None,
+    # JIT Postgres на коротких запросах дает только задержку на планирование
+    connect_args={"server_settings": {"jit": "off"}},
 )
 
 # Async session factory
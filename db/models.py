@@ -1,6 +1,6 @@
 """SQLAlchemy ORM модели"""
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, Index, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Text, Index, UniqueConstraint, Table, true
 from db.database import Base
 
 
@@ -12,7 +12,7 @@ class Measurement(Base):
     location_name = Column(String(100), nullable=False, index=True)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
-    timestamp = Column(DateTime, nullable=False, index=True)
+    timestamp = Column(DateTime, nullable=False)
     
     # Загрязняющие вещества
     pm25 = Column(Float)  # PM2.5 (μg/m³)
@@ -25,13 +25,49 @@ class Measurement(Base):
     temperature = Column(Float)  # °C
     humidity = Column(Float)     # %
     
+    # AQI по PM2.5, считается один раз при сборе данных
+    aqi = Column(Integer)
+    
     created_at = Column(DateTime, default=datetime.utcnow)
     
     __table_args__ = (
-        Index('idx_location_timestamp', 'location_name', 'timestamp'),
+        # Покрывающий индекс под выборки «локация + последние N часов» (карта, графики)
+        Index(
+            'idx_measurement_loc_ts_cover',
+            'location_name',
+            timestamp.desc(),
+            postgresql_include=['pm25', 'pm10', 'latitude', 'longitude', 'temperature', 'humidity'],
+        ),
+        # Данные пишутся по возрастанию времени — BRIN вместо B-tree для диапазонов по timestamp
+        Index('idx_measurement_ts_brin', 'timestamp', postgresql_using='brin', postgresql_with={'pages_per_range': 32}),
+        # Для префиксного поиска по городу (LIKE 'Москва%') при любой collation
+        Index('idx_location_name_pattern', 'location_name', postgresql_ops={'location_name': 'text_pattern_ops'}),
+        UniqueConstraint('location_name', 'timestamp', name='unique_measurement'),
     )
 
 
+# Промежуточная UNLOGGED таблица для массовой загрузки измерений через COPY
+# (без WAL и без ограничений; данные сразу переносятся в measurements)
+measurements_staging = Table(
+    "measurements_staging",
+    Base.metadata,
+    Column("location_name", String(100), nullable=False),
+    Column("latitude", Float, nullable=False),
+    Column("longitude", Float, nullable=False),
+    Column("timestamp", DateTime, nullable=False),
+    Column("pm25", Float),
+    Column("pm10", Float),
+    Column("no2", Float),
+    Column("o3", Float),
+    Column("co", Float),
+    Column("temperature", Float),
+    Column("humidity", Float),
+    Column("aqi", Integer),
+    Column("created_at", DateTime),
+    prefixes=["UNLOGGED"],
+)
+
+
 class Forecast(Base):
     """Прогнозы качества воздуха"""
     __tablename__ = "forecasts"
@@ -48,6 +84,12 @@ class Forecast(Base):
     confidence = Column(Float)  # 0-1
     
     created_at = Column(DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        Index('idx_forecast_location_time', 'location_name', 'forecast_time'),
+        # Последние прогнозы по локации
+        Index('idx_forecast_location_created', 'location_name', created_at.desc()),
+    )
 
 
 class Alert(Base):
@@ -66,9 +108,21 @@ class Alert(Base):
     value = Column(Float)       # Значение показателя
     threshold = Column(Float)   # Пороговое значение
     
-    is_active = Column(Boolean, default=True, index=True)
+    is_active = Column(Boolean, nullable=False, default=True, server_default=true())
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
     resolved_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        # Частичный индекс под выборку активных алертов (новые первыми)
+        Index('ix_alerts_active_created', created_at.desc(), postgresql_where=is_active.is_(True)),
+        # Активные алерты конкретной локации: в индексе только активные строки
+        Index(
+            'idx_alert_active_partial',
+            'location_name',
+            created_at.desc(),
+            postgresql_where=is_active.is_(True),
+        ),
+    )
 
 
 class Analysis(Base):
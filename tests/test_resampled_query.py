@@ -0,0 +1,31 @@
+"""Запрос /data/measurements_resampled в диалекте asyncpg"""
+import os
+from datetime import timedelta
+
+os.environ.setdefault("GROQ_API_KEY", "test")
+
+from sqlalchemy.dialects.postgresql import asyncpg
+
+from backend.api import resampled_query
+
+
+def compile_asyncpg(query):
+    return query.compile(dialect=asyncpg.dialect())
+
+
+def test_date_bin_is_not_repeated_in_group_by():
+    """date_bin встречается один раз, группировка и сортировка - по номерам колонок"""
+    sql = str(compile_asyncpg(resampled_query(24, None, "Москва", None)))
+
+    assert sql.count("date_bin(") == 1
+    assert "GROUP BY 1, 2" in sql
+    assert sql.rstrip().endswith("ORDER BY 2")
+
+
+def test_bucket_size_is_bound_per_call():
+    """Размер корзины из кэшированного lambda_stmt берется из текущего вызова"""
+    default = compile_asyncpg(resampled_query(24, None, None, None)).params
+    custom = compile_asyncpg(resampled_query(24, "Москва (Центр)", None, 120)).params
+
+    assert timedelta(hours=1) in default.values()
+    assert timedelta(hours=2) in custom.values()
@@ -1,15 +1,21 @@
 """Streamlit Dashboard"""
+import asyncio
+import functools
+import hashlib
 import logging
 from datetime import datetime, timedelta
+import numpy as np
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from streamlit_folium import folium_static
+import pyarrow as pa
 import folium
 import httpx
+import orjson
 
-from data_tools import calculate_aqi
+from data_tools import calculate_aqi_vec
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -30,57 +36,369 @@ st.markdown("*Мультиагентный анализ качества воз
 BACKEND_URL = "http://backend:8000"
 
 
+@st.cache_resource
+def get_backend_client() -> httpx.Client:
+    """HTTP-клиент к backend с пулом keep-alive соединений
+    
+    Streamlit перезапускает скрипт при каждом действии пользователя;
+    cache_resource сохраняет один клиент (и его соединения) между перезапусками.
+    """
+    return httpx.Client(
+        base_url=BACKEND_URL,
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+
+
 # Helper functions
-def get_aqi_color(aqi: int) -> str:
-    """Цвет по AQI"""
-    if aqi <= 50:
-        return "green"
-    elif aqi <= 100:
-        return "yellow"
-    elif aqi <= 150:
-        return "orange"
-    elif aqi <= 200:
-        return "red"
-    elif aqi <= 300:
-        return "purple"
-    else:
-        return "darkred"
+# Границы AQI (включительно) и соответствующие цвета маркеров
+AQI_COLOR_BINS = np.array([50, 100, 150, 200, 300])
+AQI_COLORS = np.array(["green", "yellow", "orange", "red", "purple", "darkred"])
+
+# Зум карты по разбросу координат: разброс не больше границы - следующий зум
+ZOOM_BINS = np.array([0.5, 2, 5, 10, 20])
+ZOOMS = np.array([10, 9, 7, 6, 5, 4])
+
+
+def aqi_column(pm25: pd.Series) -> np.ndarray:
+    """AQI для всего столбца PM2.5 одним векторным расчетом; пропуски считаются нулем"""
+    return calculate_aqi_vec(pm25.fillna(0).to_numpy(dtype=np.float64))
+
+
+def get_aqi_colors(aqi) -> np.ndarray:
+    """Цвета по AQI для всего ряда сразу"""
+    return AQI_COLORS[np.searchsorted(AQI_COLOR_BINS, aqi, side="left")]
+
+
+async def _get_many(requests: list) -> list:
+    """Параллельные GET-запросы к backend; ответы (или ошибки) в порядке запросов"""
+    # AsyncClient привязан к event loop, а asyncio.run создает новый на каждый
+    # перезапуск скрипта, поэтому клиент живет в пределах одного вызова
+    async with httpx.AsyncClient(
+        base_url=BACKEND_URL,
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_keepalive_connections=20),
+    ) as client:
+        # Ошибка одного запроса не отменяет остальные - каждый ответ проверяется отдельно
+        return await asyncio.gather(
+            *(client.get(path, params=params) for path, params in requests),
+            return_exceptions=True,
+        )
+
 
+def _response_json(response, parse=orjson.loads):
+    """Тело успешного ответа; исключение запроса или HTTP-ошибка пробрасываются"""
+    if isinstance(response, Exception):
+        raise response
+    response.raise_for_status()
+    return parse(response.content)
 
-def fetch_measurements(hours=24, location=None):
-    """Fetch measurements from backend API"""
+
+def _parse_ndjson(content: bytes) -> list:
+    """Измерения в формате NDJSON: одно измерение на строку"""
+    return [orjson.loads(line) for line in content.splitlines() if line]
+
+
+# Поля измерений, которые использует панель (карта, статистика, таблица);
+# ряды графиков берутся из measurements_resampled
+MEASUREMENT_FIELDS = ["id", "location_name", "latitude", "longitude", "timestamp", "pm25", "pm10", "no2", "temperature", "aqi"]
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _fetch_dashboard_raw(hours: int, city: str | None) -> tuple:
+    """(measurements, alerts, forecasts, analyses, errors) одним набором параллельных запросов
+    
+    Ошибка измерений пробрасывается (и не кэшируется). Таблица, которую не удалось
+    загрузить, возвращается как None, а ее ошибка - в errors; остальные данные
+    при этом сохраняются.
+    """
+    city_params = {"city": city} if city else {}
+    table_requests = [
+        ("/api/data/alerts", {"active_only": True}),
+        ("/api/data/forecasts", {}),
+        ("/api/data/analyses", {"hours": 168, **city_params}),
+    ]
+    measurements, *table_responses = asyncio.run(_get_many([
+        ("/api/data/measurements", {"hours": hours, "fields": ",".join(MEASUREMENT_FIELDS), **city_params}),
+        *table_requests,
+    ]))
+    
+    tables, errors = [], {}
+    for (path, _), response in zip(table_requests, table_responses):
+        try:
+            tables.append(_response_json(response))
+        except Exception as e:
+            logger.error(f"Error fetching {path}: {e!r}")
+            tables.append(None)
+            errors[path] = f"{path}: {e!r}"
+    
+    return (_response_json(measurements, _parse_ndjson), *tables, errors)
+
+
+# Числовые колонки измерений, для которых хватает float32
+FLOAT32_COLUMNS = ["latitude", "longitude", "pm25", "pm10", "no2", "o3", "co", "temperature", "humidity"]
+
+
+def measurements_frame(records: list) -> pd.DataFrame:
+    """DataFrame измерений с производными колонками city и aqi"""
+    if not records:
+        return pd.DataFrame()
+    
+    df = pd.DataFrame(records)
+    # Строковые операции pandas вместо вызова extract_city_name на каждую строку
+    df["city"] = df["location_name"].str.split(" (", n=1, regex=False).str[0]
+    
+    # AQI сохраняется при сборе данных; досчитываем только строки без него
+    if "aqi" not in df:
+        df["aqi"] = np.nan
+    missing = df["aqi"].isna()
+    if missing.any():
+        df.loc[missing, "aqi"] = aqi_column(df.loc[missing, "pm25"])
+    
+    # Компактные типы: вдвое меньше памяти и байт при сериализации в Arrow/Plotly.
+    # AQI укладывается в int16 (шкала до 500, выбросы датчиков обрезаются)
+    df["aqi"] = df["aqi"].clip(upper=np.iinfo(np.int16).max).astype(np.int16)
+    df = df.astype({col: "float32" for col in FLOAT32_COLUMNS if col in df})
+    df["timestamp"] = pd.to_datetime(df["timestamp"]).astype("datetime64[s]")
+    df["location_name"] = df["location_name"].astype("category")
+    return df
+
+
+# Фреймы строятся один раз на набор данных; cache_data отдает каждому вызову свою копию
+@st.cache_data(ttl=60, show_spinner=False)
+def _measurements_frame(hours: int, city: str | None) -> pd.DataFrame:
+    return measurements_frame(_fetch_dashboard_raw(hours, city)[0])
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _resampled_frame(hours: int, city: str | None) -> pd.DataFrame:
+    params = {"hours": hours}
+    if city:
+        params["city"] = city
+    response = get_backend_client().get("/api/data/measurements_resampled", params=params)
+    response.raise_for_status()
+    return measurements_frame(orjson.loads(response.content))
+
+
+def fetch_measurements(hours=24, city=None) -> pd.DataFrame:
+    """Fetch measurements from backend API as DataFrame (город фильтруется на backend)"""
     try:
-        params = {"hours": hours}
-        if location:
-            params["location"] = location
-        response = httpx.get(f"{BACKEND_URL}/api/data/measurements", params=params, timeout=30.0)
-        response.raise_for_status()
-        return response.json()
+        return _measurements_frame(hours, city)
     except Exception as e:
         logger.error(f"Error fetching measurements: {e}")
-        return []
+        return pd.DataFrame()
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_city_list() -> list:
+    response = get_backend_client().get("/api/data/cities", params={"hours": 1})
+    response.raise_for_status()
+    return orjson.loads(response.content)
 
 
-def fetch_alerts():
-    """Fetch active alerts from backend API"""
+def fetch_cities() -> list:
+    """Города с измерениями за последний час (для фильтра)"""
     try:
-        response = httpx.get(f"{BACKEND_URL}/api/data/alerts", params={"active_only": True}, timeout=30.0)
-        response.raise_for_status()
-        return response.json()
+        return _fetch_city_list()
     except Exception as e:
-        logger.error(f"Error fetching alerts: {e}")
+        logger.error(f"Error fetching cities: {e}")
         return []
 
 
-def fetch_forecasts():
-    """Fetch forecasts from backend API"""
+def fetch_chart_data(hours=24, city=None) -> pd.DataFrame:
+    """Fetch time-bucketed measurements for charts (число точек не зависит от объема данных)"""
     try:
-        response = httpx.get(f"{BACKEND_URL}/api/data/forecasts", timeout=30.0)
-        response.raise_for_status()
-        return response.json()
+        return _resampled_frame(hours, city)
     except Exception as e:
-        logger.error(f"Error fetching forecasts: {e}")
+        logger.error(f"Error fetching chart data: {e}")
+        return pd.DataFrame()
+
+
+def city_param(city: str) -> str | None:
+    """Значение фильтра города для запросов к backend (None - все города)"""
+    return None if city == "Все города" else city
+
+
+# Окно, которое загружается для графиков целиком; меньшие периоды вырезаются из него
+CHART_BASE_HOURS = 168
+
+
+def chart_data(hours: int, city: str) -> pd.DataFrame:
+    """Данные для графиков с учетом фильтра города
+    
+    При корзинах backend в 1 час ряды за меньший период совпадают с хвостом
+    недельного, поэтому смена периода не требует нового запроса.
+    """
+    df = fetch_chart_data(hours=max(hours, CHART_BASE_HOURS), city=city_param(city))
+    if df.empty or hours >= CHART_BASE_HOURS:
+        return df
+    
+    # Строки отсортированы по времени - начало окна находится бинарным поиском
+    cutoff = pd.Timestamp(datetime.utcnow() - timedelta(hours=hours)).ceil("h")
+    return df.iloc[df["timestamp"].searchsorted(cutoff):]
+
+
+def location_groups(df: pd.DataFrame) -> list:
+    """Строки по локациям: одно разбиение groupby на все ряды графика, без маски на каждую локацию"""
+    return list(df.groupby("location_name", sort=False, observed=True))
+
+
+# Подписи и стиль рядов показателей на графиках
+TRACE_LABELS = {"pm25": "PM2.5", "pm10": "PM10", "no2": "NO2", "o3": "O3", "co": "CO"}
+TRACE_STYLES = {
+    "pm25": {"mode": "lines+markers", "line": {"width": 2}},
+    "pm10": {"mode": "lines", "line": {"width": 1, "dash": "dot"}},
+}
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def metric_traces(hours: int, city: str, column: str) -> list:
+    """Ряды одного показателя по локациям; переключение других показателей их не пересчитывает"""
+    df = chart_data(hours, city)
+    if column not in df.columns:
         return []
+    
+    style = TRACE_STYLES.get(column, {"mode": "lines"})
+    df = df[["location_name", "timestamp", column]].dropna(subset=[column])
+    return [
+        go.Scattergl(x=df_loc["timestamp"], y=df_loc[column], name=f"{loc} ({TRACE_LABELS[column]})", **style)
+        for loc, df_loc in location_groups(df)
+    ]
+
+
+# Фигуры Plotly кэшируются по (период, город, показатели): перезапуск скрипта
+# без смены этих параметров не строит графики заново, а при переключении
+# показателя ряды берутся из кэша metric_traces. Ряды рисуются через WebGL,
+# uirevision сохраняет зум и выбор легенды при обновлении данных
+@st.cache_data(ttl=60, show_spinner=False)
+def build_pm_figure(hours: int, city: str, show_pm25: bool, show_pm10: bool) -> go.Figure:
+    """График PM2.5 и PM10 по локациям"""
+    fig = go.Figure()
+    for column, shown in (("pm25", show_pm25), ("pm10", show_pm10)):
+        if shown:
+            fig.add_traces(metric_traces(hours, city, column))
+    
+    fig.update_layout(
+        title="PM2.5 и PM10 (μg/m³)",
+        xaxis_title="Время",
+        yaxis_title="Концентрация (μg/m³)",
+        hovermode='x unified',
+        height=400,
+        uirevision="constant"
+    )
+    return fig
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def build_gases_figure(hours: int, city: str, show_no2: bool, show_o3: bool, show_co: bool) -> go.Figure:
+    """График NO2, O3 и CO по локациям"""
+    fig = go.Figure()
+    for column, shown in (("no2", show_no2), ("o3", show_o3), ("co", show_co)):
+        if shown:
+            fig.add_traces(metric_traces(hours, city, column))
+    
+    fig.update_layout(title="Загрязняющие вещества (μg/m³)", xaxis_title="Время", yaxis_title="Концентрация", hovermode='x unified', height=400, uirevision="constant")
+    return fig
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def build_temperature_figure(hours: int, city: str) -> go.Figure:
+    """График температуры по локациям"""
+    df_temp = chart_data(hours, city).dropna(subset=["temperature"])
+    fig = px.line(df_temp, x="timestamp", y="temperature", color="location_name", title="Температура (°C)", render_mode="webgl")
+    return fig.update_layout(uirevision="constant")
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def build_aqi_figure(hours: int, city: str) -> go.Figure:
+    """График AQI по локациям"""
+    fig = px.line(chart_data(hours, city), x="timestamp", y="aqi", color="location_name", title="AQI (Air Quality Index)", render_mode="webgl")
+    return fig.update_layout(uirevision="constant")
+
+
+def fetch_tables(hours=24, city=None):
+    """Fetch alerts, forecasts and analyses from backend API concurrently
+    
+    Возвращает (alerts, forecasts, analyses, error); незагруженные списки пустые,
+    error - ошибка загрузки анализов. Анализы фильтруются по городу на backend.
+    """
+    try:
+        _, alerts, forecasts, analyses, errors = _fetch_dashboard_raw(hours, city)
+        if not errors:
+            return alerts, forecasts, analyses, None
+        
+        # Неудачная загрузка не должна жить в кэше - следующий перезапуск повторит запросы
+        _fetch_dashboard_raw.clear(hours, city)
+        analyses_error = errors.get("/api/data/analyses")
+        return (
+            alerts or [],
+            forecasts or [],
+            analyses or [],
+            RuntimeError(analyses_error) if analyses_error else None,
+        )
+    except Exception as e:
+        logger.error(f"Error fetching alerts/forecasts/analyses: {e}")
+        return [], [], [], e
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def city_statistics(hours: int, city: str | None) -> pd.DataFrame:
+    """Сводная статистика по городам (считается один раз на набор данных)"""
+    df = fetch_measurements(hours=hours, city=city)
+    
+    # Группируем по городам
+    city_stats = df.groupby('city').agg({
+        'pm25': ['mean', 'min', 'max', 'std'],
+        'pm10': ['mean', 'min', 'max'],
+        'temperature': 'mean',
+        'aqi': 'mean'
+    }).round(2)
+    
+    city_stats.columns = ['PM2.5 средн', 'PM2.5 мин', 'PM2.5 макс', 'PM2.5 σ', 'PM10 средн', 'PM10 мин', 'PM10 макс', 'Темп средн', 'AQI средн']
+    return city_stats
+
+
+@st.cache_data(ttl=60, show_spinner=False)
+def latest_analyses(hours: int, city: str | None) -> pd.DataFrame:
+    """Последний анализ по каждой локации, от новых к старым (считается один раз на набор данных)"""
+    analyses = _fetch_dashboard_raw(hours, city)[3]
+    df = pd.DataFrame([a for a in analyses if isinstance(a, dict)])
+    if df.empty or "location_name" not in df:
+        return pd.DataFrame()
+    
+    df["created_at"] = pd.to_datetime(df["created_at"])
+    df["city"] = df["location_name"].str.split(" (", n=1, regex=False).str[0]
+    return (
+        df.dropna(subset=["location_name"])
+        .sort_values("created_at", ascending=False, kind="stable")
+        .drop_duplicates("location_name")
+        .reset_index(drop=True)
+    )
+
+
+def analysis_table(latest: pd.DataFrame) -> pd.DataFrame:
+    """Таблица результатов анализа для отображения"""
+    return pd.DataFrame({
+        "Локация": latest["location_name"],
+        "Тренд PM2.5": latest["pm25_trend"].fillna("N/A"),
+        "Средний PM2.5": latest["pm25_avg"].fillna(0).map("{:.1f}".format),
+        "Аномалии": latest["anomalies_count"].fillna(0).astype(np.int16),
+        "Дата анализа": latest["created_at"].dt.strftime("%d.%m.%Y %H:%M").fillna("N/A"),
+    })
+
+
+# Какие закэшированные данные устаревают после работы агента
+AGENT_CACHES = {
+    "collect_data": [
+        _fetch_dashboard_raw, _measurements_frame, _resampled_frame, _fetch_city_list, city_statistics,
+        metric_traces, build_pm_figure, build_gases_figure, build_temperature_figure, build_aqi_figure,
+    ],
+    "analyze": [_fetch_dashboard_raw, latest_analyses],
+    "forecast": [_fetch_dashboard_raw],
+    "check_alerts": [_fetch_dashboard_raw],
+}
 
 
 def call_agent(task_type: str, location_filter: str | None = None):
@@ -90,64 +408,147 @@ def call_agent(task_type: str, location_filter: str | None = None):
         if location_filter and location_filter != "Все города":
             params["location_filter"] = location_filter
         
-        response = httpx.post(
-            f"{BACKEND_URL}/api/run-agent/{task_type}", 
+        response = get_backend_client().post(
+            f"/api/run-agent/{task_type}", 
             params=params,  # ✅ Передаем параметры
             timeout=120.0
         )
         response.raise_for_status()
-        return response.json()
+        
+        # Агент записал новые данные - сбрасываем соответствующий кэш
+        for cached in AGENT_CACHES.get(task_type, []):
+            cached.clear()
+        
+        return orjson.loads(response.content)
     except Exception as e:
         logger.error(f"Agent call error: {e}")
         return {"status": "error", "message": str(e)}
 
 
+def format_readings(values: pd.Series, unit: str = "", zero_is_missing: bool = True) -> pd.Series:
+    """Значения показателя для попапов; пустые (и по умолчанию нулевые) - N/A"""
+    text = values.map(("{:.1f}" + unit).format, na_action="ignore")
+    present = values.notna() & values.ne(0) if zero_is_missing else values.notna()
+    return text.where(present, "N/A")
+
+
+# Различных локаций единицы-десятки, поэтому повторные вызовы - поиск в словаре
+@functools.lru_cache(maxsize=1024)
 def extract_city_name(location_name: str) -> str:
     """Извлекает название города из полного имени локации"""
     return location_name.split(" (")[0] if " (" in location_name else location_name
 
 
-# Sidebar
-with st.sidebar:
-    st.header("⚙️ Управление")
-    
-    # ✅ СНАЧАЛА ФИЛЬТРЫ (переместили выше!)
-    st.subheader("🔍 Фильтры")
+def filter_by_city(records: list, city: str) -> list:
+    """Записи API только для выбранного города"""
+    if city == "Все города":
+        return records
+    return [r for r in records if extract_city_name(r.get("location_name", "")) == city]
+
+
+def records_table(records: list, columns: list) -> pa.Table:
+    """Arrow-таблица из JSON-записей для st.dataframe, без промежуточного DataFrame"""
+    return pa.Table.from_pylist(records).select(columns)
+
+
+# Шаблон всплывающей подсказки маркера: разбирается один раз, в цикле только format
+POPUP_TEMPLATE = """
+<div style='width: 240px; font-family: Arial'>
+    <h4 style='margin: 5px 0; color: #333'>{name}</h4>
+    <hr style='margin: 8px 0; border: 0; border-top: 1px solid #ddd'>
+    <table style='width: 100%; font-size: 13px'>
+        <tr><td>📍 Координаты:</td><td><b>{lat:.4f}, {lon:.4f}</b></td></tr>
+        <tr><td>🌫️ PM2.5:</td><td><b>{pm25}</b> μg/m³</td></tr>
+        <tr><td>🌫️ PM10:</td><td><b>{pm10}</b> μg/m³</td></tr>
+        <tr><td>💨 NO2:</td><td><b>{no2}</b> μg/m³</td></tr>
+        <tr><td>🌡️ Температура:</td><td><b>{temp}</b></td></tr>
+        <tr><td>📊 AQI:</td><td><b style='color:{color}'>{aqi}</b></td></tr>
+        <tr><td>🕐 Время:</td><td><b>{ts}</b></td></tr>
+    </table>
+</div>
+"""
+
+
+def build_map_html(locations_df: pd.DataFrame) -> str:
+    """HTML карты Leaflet с маркерами AQI по последним измерениям локаций"""
+    # Вычисляем центр карты
+    lat_arr = locations_df["latitude"].to_numpy(dtype=np.float64, na_value=np.nan)
+    lon_arr = locations_df["longitude"].to_numpy(dtype=np.float64, na_value=np.nan)
+    mask = ~(np.isnan(lat_arr) | np.isnan(lon_arr))
     
-    # Получаем список городов
-    all_measurements = fetch_measurements(hours=1)
-    cities = ["Все города"] + sorted(list(set([extract_city_name(m.get("location_name", "")) for m in all_measurements])))
+    if mask.any():
+        center_lat = lat_arr[mask].mean()
+        center_lon = lon_arr[mask].mean()
+        max_range = max(np.ptp(lat_arr[mask]), np.ptp(lon_arr[mask]))
+        zoom = int(ZOOMS[np.searchsorted(ZOOM_BINS, max_range, side="left")])
+    else:
+        center_lat, center_lon, zoom = 55.7558, 37.6176, 5
     
-    selected_city = st.selectbox(
-        "Город:",
-        cities,
-        index=0
+    # Создаем карту
+    m = folium.Map(
+        location=[center_lat, center_lon],
+        zoom_start=zoom,
+        tiles="OpenStreetMap"
     )
     
-    time_range = st.selectbox(
-        "Период:",
-        ["1 час", "6 часов", "24 часа", "7 дней"],
-        index=2
-    )
+    # Цвета считаются сразу для всех локаций
+    locations_df = locations_df[mask].copy()
+    locations_df["color"] = get_aqi_colors(locations_df["aqi"])
     
-    hours_map = {"1 час": 1, "6 часов": 6, "24 часа": 24, "7 дней": 168}
-    selected_hours = hours_map[time_range]
+    # Поля попапов готовятся по столбцам, шаблон заполняется из готовых строк
+    popup_fields = pd.DataFrame({
+        "name": locations_df["location_name"].astype(str),
+        "lat": locations_df["latitude"],
+        "lon": locations_df["longitude"],
+        "pm25": format_readings(locations_df["pm25"]),
+        "pm10": format_readings(locations_df["pm10"]),
+        "no2": format_readings(locations_df["no2"]),
+        "temp": format_readings(locations_df["temperature"], "°C", zero_is_missing=False),
+        "color": locations_df["color"],
+        "aqi": locations_df["aqi"],
+        "ts": locations_df["timestamp"].dt.strftime("%d.%m.%Y %H:%M").fillna("N/A"),
+    })
+    locations_df["popup"] = [POPUP_TEMPLATE.format_map(fields) for fields in popup_fields.to_dict("records")]
     
-    # Выбор показателей для графиков
-    st.subheader("📈 Показатели")
-    show_pm25 = st.checkbox("PM2.5", value=True)
-    show_pm10 = st.checkbox("PM10", value=True)
-    show_no2 = st.checkbox("NO2", value=False)
-    show_o3 = st.checkbox("O3 (Озон)", value=False)
-    show_co = st.checkbox("CO", value=False)
-    show_temp = st.checkbox("Температура", value=True)
-    show_aqi = st.checkbox("AQI", value=True)
+    # Все маркеры - один GeoJSON-слой: точки и подписи готовятся одним проходом,
+    # а отрисовкой кружков занимается Leaflet на стороне браузера
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(row.longitude), float(row.latitude)]},
+            "properties": {
+                "color": row.color,
+                "tooltip": f"{row.location_name}: AQI {row.aqi}",
+                "popup": row.popup,
+            },
+        }
+        for row in locations_df.itertuples(index=False)
+    ]
     
-    st.divider()
+    folium.GeoJson(
+        {"type": "FeatureCollection", "features": features},
+        name="Локации",
+        marker=folium.CircleMarker(radius=8, fill=True),
+        style_function=lambda feature: {
+            "color": feature["properties"]["color"],
+            "fillColor": feature["properties"]["color"],
+            "fillOpacity": 0.7,
+            "weight": 2,
+        },
+        tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False),
+        popup=folium.GeoJsonPopup(fields=["popup"], labels=False, localize=False, max_width=280),
+    ).add_to(m)
     
-    # ✅ ПОТОМ АГЕНТЫ (теперь selected_city уже определен!)
-    st.subheader("🤖 Агенты")
+    return folium.Figure().add_child(m).render()
+
+
+@st.fragment
+def agent_controls(selected_city: str):
+    """Кнопки агентов
     
+    Нажатие перезапускает только этот фрагмент, а не всю панель; полный
+    перезапуск делается один раз, когда агент успешно обновил данные.
+    """
     col1, col2 = st.columns(2)
     with col1:
         if st.button("🔄 Данные", use_container_width=True):
@@ -174,6 +575,7 @@ with st.sidebar:
                 result = call_agent("forecast")
                 if result.get("status") == "success":
                     st.info("✅ Готово!")
+                    st.rerun()
     
     with col4:
         if st.button("🚨 Алерты", use_container_width=True):
@@ -181,12 +583,56 @@ with st.sidebar:
                 result = call_agent("check_alerts")
                 if result.get("status") == "success":
                     st.info("✅ Готово!")
+                    st.rerun()
+
+
+# Sidebar
+with st.sidebar:
+    st.header("⚙️ Управление")
+    
+    # ✅ СНАЧАЛА ФИЛЬТРЫ (переместили выше!)
+    st.subheader("🔍 Фильтры")
+    
+    # Получаем список городов
+    cities = ["Все города"] + fetch_cities()
+    
+    selected_city = st.selectbox(
+        "Город:",
+        cities,
+        index=0
+    )
+    
+    time_range = st.selectbox(
+        "Период:",
+        ["1 час", "6 часов", "24 часа", "7 дней"],
+        index=2
+    )
+    
+    hours_map = {"1 час": 1, "6 часов": 6, "24 часа": 24, "7 дней": 168}
+    selected_hours = hours_map[time_range]
+    
+    # Выбор показателей для графиков
+    st.subheader("📈 Показатели")
+    show_pm25 = st.checkbox("PM2.5", value=True)
+    show_pm10 = st.checkbox("PM10", value=True)
+    show_no2 = st.checkbox("NO2", value=False)
+    show_o3 = st.checkbox("O3 (Озон)", value=False)
+    show_co = st.checkbox("CO", value=False)
+    show_temp = st.checkbox("Температура", value=True)
+    show_aqi = st.checkbox("AQI", value=True)
+    
+    st.divider()
+    
+    # ✅ ПОТОМ АГЕНТЫ (теперь selected_city уже определен!)
+    st.subheader("🤖 Агенты")
+    
+    agent_controls(selected_city)
 
 # Получаем данные с учетом фильтра города
-if selected_city != "Все города":
-    measurements = [m for m in fetch_measurements(hours=selected_hours) if extract_city_name(m.get("location_name", "")) == selected_city]
-else:
-    measurements = fetch_measurements(hours=selected_hours)
+measurements_df = fetch_measurements(hours=selected_hours, city=city_param(selected_city))
+
+# Алерты, прогнозы и анализы независимы - загружаем их параллельно один раз
+alerts, forecasts, analyses, tables_error = fetch_tables(selected_hours, city_param(selected_city))
 
 # Main content
 tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["🗺️ Карта", "📈 Графики", "📊 Статистика", "🔬 Анализ", "💬 Чат", "📋 Данные"])
@@ -198,109 +644,40 @@ with tab1:
     if selected_city != "Все города":
         st.info(f"🔍 Фильтр: **{selected_city}**")
     
-    map_data = measurements if selected_city != "Все города" else fetch_measurements(hours=1)
+    # Для всех городов на карте - локации с данными за последний час; они уже есть
+    # в загруженном окне (период не меньше часа), отдельный запрос не нужен
+    if selected_city != "Все города" or measurements_df.empty:
+        map_df = measurements_df
+    else:
+        map_df = measurements_df[measurements_df["timestamp"] >= datetime.utcnow() - timedelta(hours=1)]
     
-    if map_data:
-        # Группируем по location_name
-        unique_locations = {}
-        for m in map_data:
-            loc_name = m.get("location_name", "Unknown")
-            if loc_name not in unique_locations:
-                unique_locations[loc_name] = m
+    if not map_df.empty:
+        # Самое свежее измерение по каждой локации, независимо от порядка строк в ответе
+        locations_df = map_df.sort_values("timestamp").drop_duplicates("location_name", keep="last")
+        pm25_values = locations_df["pm25"].to_numpy(dtype=np.float64, na_value=np.nan)
+        aqi_values = locations_df["aqi"].to_numpy()
         
         # Статистика
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("📍 Локаций", len(unique_locations))
+            st.metric("📍 Локаций", len(locations_df))
         with col2:
-            avg_pm25 = sum([m.get("pm25", 0) for m in unique_locations.values() if m.get("pm25")]) / len(unique_locations) if unique_locations else 0
+            avg_pm25 = np.nansum(pm25_values) / len(locations_df)
             st.metric("🌫️ Средний PM2.5", f"{avg_pm25:.1f} μg/m³")
         with col3:
-            avg_aqi = sum([calculate_aqi(m.get("pm25", 0)) for m in unique_locations.values() if m.get("pm25")]) / len(unique_locations) if unique_locations else 0
+            avg_aqi = aqi_values.sum() / len(locations_df)
             st.metric("📊 Средний AQI", f"{int(avg_aqi)}")
         with col4:
-            cities_count = len(set([extract_city_name(loc) for loc in unique_locations.keys()]))
+            cities_count = locations_df["city"].nunique()
             st.metric("🏙️ Городов", cities_count)
         
-        # Вычисляем центр карты
-        lats = [m.get("latitude") for m in unique_locations.values() if m.get("latitude")]
-        lons = [m.get("longitude") for m in unique_locations.values() if m.get("longitude")]
+        # Карта пересобирается только при смене данных, иначе берется готовый HTML
+        map_key = hashlib.md5(locations_df["id"].to_numpy(dtype=np.int64).tobytes()).hexdigest()
+        if st.session_state.get("map_key") != map_key:
+            st.session_state["map_html"] = build_map_html(locations_df)
+            st.session_state["map_key"] = map_key
         
-        if lats and lons:
-            center_lat = sum(lats) / len(lats)
-            center_lon = sum(lons) / len(lons)
-            lat_range = max(lats) - min(lats)
-            lon_range = max(lons) - min(lons)
-            max_range = max(lat_range, lon_range)
-            
-            if max_range > 20:
-                zoom = 4
-            elif max_range > 10:
-                zoom = 5
-            elif max_range > 5:
-                zoom = 6
-            elif max_range > 2:
-                zoom = 7
-            elif max_range > 0.5:
-                zoom = 9
-            else:
-                zoom = 10
-        else:
-            center_lat, center_lon, zoom = 55.7558, 37.6176, 5
-        
-        # Создаем карту
-        m = folium.Map(
-            location=[center_lat, center_lon],
-            zoom_start=zoom,
-            tiles="OpenStreetMap"
-        )
-        
-        # Добавляем маркеры
-        for loc_name, measurement in unique_locations.items():
-            lat = measurement.get("latitude")
-            lon = measurement.get("longitude")
-            pm25 = measurement.get("pm25")
-            
-            if lat is None or lon is None:
-                continue
-            
-            pm25_str = f"{pm25:.1f}" if pm25 else "N/A"
-            pm10 = measurement.get("pm10")
-            pm10_str = f"{pm10:.1f}" if pm10 else "N/A"
-            no2 = measurement.get("no2")
-            no2_str = f"{no2:.1f}" if no2 else "N/A"
-            temp = measurement.get("temperature")
-            temp_str = f"{temp:.1f}°C" if temp is not None else "N/A"
-            
-            aqi = calculate_aqi(pm25) if pm25 else 0
-            color = get_aqi_color(aqi)
-            
-            folium.CircleMarker(
-                location=[float(lat), float(lon)],
-                radius=8,
-                popup=folium.Popup(f"""
-                    <div style='width: 240px; font-family: Arial'>
-                        <h4 style='margin: 5px 0; color: #333'>{loc_name}</h4>
-                        <hr style='margin: 8px 0; border: 0; border-top: 1px solid #ddd'>
-                        <table style='width: 100%; font-size: 13px'>
-                            <tr><td>📍 Координаты:</td><td><b>{lat:.4f}, {lon:.4f}</b></td></tr>
-                            <tr><td>🌫️ PM2.5:</td><td><b>{pm25_str}</b> μg/m³</td></tr>
-                            <tr><td>🌫️ PM10:</td><td><b>{pm10_str}</b> μg/m³</td></tr>
-                            <tr><td>💨 NO2:</td><td><b>{no2_str}</b> μg/m³</td></tr>
-                            <tr><td>🌡️ Температура:</td><td><b>{temp_str}</b></td></tr>
-                            <tr><td>📊 AQI:</td><td><b style='color:{color}'>{aqi}</b></td></tr>
-                        </table>
-                    </div>
-                """, max_width=280),
-                tooltip=f"{loc_name}: AQI {aqi}",
-                color=color,
-                fill=True,
-                fillColor=color,
-                fillOpacity=0.7,
-                weight=2
-            ).add_to(m)
-        
-        folium_static(m, width=1200, height=600)
+        components.html(st.session_state["map_html"], width=1200, height=610)
         
         # Легенда
         st.markdown("""
@@ -317,88 +694,30 @@ with tab2:
     if selected_city != "Все города":
         st.info(f"🔍 Фильтр: **{selected_city}**")
     
-    if measurements and len(measurements) > 0:
-        df = pd.DataFrame(measurements)
-        df['city'] = df['location_name'].apply(extract_city_name)
-        df['aqi'] = df['pm25'].apply(lambda x: calculate_aqi(x) if x else 0)
-        
-        st.write(f"📊 Загружено записей: **{len(df)}**")
+    # Графики строятся по усредненным на backend корзинам, а не по сырым измерениям
+    chart_df = chart_data(selected_hours, selected_city)
+    
+    if not chart_df.empty:
+        st.write(f"📊 Точек на графиках: **{len(chart_df)}**")
         
         # PM2.5 и PM10
         if show_pm25 or show_pm10:
-            fig = go.Figure()
-            
-            if show_pm25 and "pm25" in df.columns:
-                for loc in df['location_name'].unique():
-                    df_loc = df[df['location_name'] == loc].dropna(subset=["pm25"])
-                    if not df_loc.empty:
-                        fig.add_trace(go.Scatter(
-                            x=df_loc["timestamp"],
-                            y=df_loc["pm25"],
-                            mode='lines+markers',
-                            name=f"{loc} (PM2.5)",
-                            line=dict(width=2)
-                        ))
-            
-            if show_pm10 and "pm10" in df.columns:
-                for loc in df['location_name'].unique():
-                    df_loc = df[df['location_name'] == loc].dropna(subset=["pm10"])
-                    if not df_loc.empty:
-                        fig.add_trace(go.Scatter(
-                            x=df_loc["timestamp"],
-                            y=df_loc["pm10"],
-                            mode='lines',
-                            name=f"{loc} (PM10)",
-                            line=dict(width=1, dash='dot')
-                        ))
-            
-            fig.update_layout(
-                title="PM2.5 и PM10 (μg/m³)",
-                xaxis_title="Время",
-                yaxis_title="Концентрация (μg/m³)",
-                hovermode='x unified',
-                height=400
-            )
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(build_pm_figure(selected_hours, selected_city, show_pm25, show_pm10), use_container_width=True)
         
         # NO2, O3, CO
         if show_no2 or show_o3 or show_co:
-            fig2 = go.Figure()
-            
-            if show_no2 and "no2" in df.columns:
-                df_no2 = df.dropna(subset=["no2"])
-                for loc in df_no2['location_name'].unique():
-                    df_loc = df_no2[df_no2['location_name'] == loc]
-                    fig2.add_trace(go.Scatter(x=df_loc["timestamp"], y=df_loc["no2"], mode='lines', name=f"{loc} (NO2)"))
-            
-            if show_o3 and "o3" in df.columns:
-                df_o3 = df.dropna(subset=["o3"])
-                for loc in df_o3['location_name'].unique():
-                    df_loc = df_o3[df_o3['location_name'] == loc]
-                    fig2.add_trace(go.Scatter(x=df_loc["timestamp"], y=df_loc["o3"], mode='lines', name=f"{loc} (O3)"))
-            
-            if show_co and "co" in df.columns:
-                df_co = df.dropna(subset=["co"])
-                for loc in df_co['location_name'].unique():
-                    df_loc = df_co[df_co['location_name'] == loc]
-                    fig2.add_trace(go.Scatter(x=df_loc["timestamp"], y=df_loc["co"], mode='lines', name=f"{loc} (CO)"))
-            
-            fig2.update_layout(title="Загрязняющие вещества (μg/m³)", xaxis_title="Время", yaxis_title="Концентрация", hovermode='x unified', height=400)
-            st.plotly_chart(fig2, use_container_width=True)
+            st.plotly_chart(build_gases_figure(selected_hours, selected_city, show_no2, show_o3, show_co), use_container_width=True)
         
         # Температура и AQI
         col1, col2 = st.columns(2)
         
         with col1:
-            if show_temp and "temperature" in df.columns:
-                df_temp = df.dropna(subset=["temperature"])
-                fig_temp = px.line(df_temp, x="timestamp", y="temperature", color="location_name", title="Температура (°C)")
-                st.plotly_chart(fig_temp, use_container_width=True)
+            if show_temp and "temperature" in chart_df.columns:
+                st.plotly_chart(build_temperature_figure(selected_hours, selected_city), use_container_width=True)
         
         with col2:
             if show_aqi:
-                fig_aqi = px.line(df, x="timestamp", y="aqi", color="location_name", title="AQI (Air Quality Index)")
-                st.plotly_chart(fig_aqi, use_container_width=True)
+                st.plotly_chart(build_aqi_figure(selected_hours, selected_city), use_container_width=True)
     else:
         st.info("📥 Нет данных для графиков")
 
@@ -406,20 +725,8 @@ with tab2:
 with tab3:
     st.header("📊 Статистика по городам")
     
-    if measurements:
-        df = pd.DataFrame(measurements)
-        df['city'] = df['location_name'].apply(extract_city_name)
-        df['aqi'] = df['pm25'].apply(lambda x: calculate_aqi(x) if x else 0)
-        
-        # Группируем по городам
-        city_stats = df.groupby('city').agg({
-            'pm25': ['mean', 'min', 'max', 'std'],
-            'pm10': ['mean', 'min', 'max'],
-            'temperature': 'mean',
-            'aqi': 'mean'
-        }).round(2)
-        
-        city_stats.columns = ['PM2.5 средн', 'PM2.5 мин', 'PM2.5 макс', 'PM2.5 σ', 'PM10 средн', 'PM10 мин', 'PM10 макс', 'Темп средн', 'AQI средн']
+    if not measurements_df.empty:
+        city_stats = city_statistics(selected_hours, city_param(selected_city))
         
         st.dataframe(city_stats, use_container_width=True)
         
@@ -439,114 +746,92 @@ with tab4:
     if selected_city != "Все города":
         st.info(f"🔍 Фильтр: **{selected_city}**")
     
-    # Получаем анализы
+    # Анализы загружены заранее вместе с алертами и прогнозами
     try:
-        response = httpx.get(f"{BACKEND_URL}/api/data/analyses", params={"hours": 168}, timeout=30.0)
-        response.raise_for_status()
-        analyses = response.json()
+        if tables_error is not None:
+            raise tables_error
         
         # ✅ Отладка: проверяем тип данных
         if not isinstance(analyses, list):
             st.error(f"⚠️ Неожиданный формат данных: {type(analyses)}")
             st.json(analyses)
         elif len(analyses) == 0:
-            st.warning("⚠️ Нет результатов анализа. Нажмите '📊 Анализ' в боковой панели.")
-        else:
-            # Фильтруем по городу
+            # Анализы уже отфильтрованы по городу на backend
             if selected_city != "Все города":
-                analyses = [
-                    a for a in analyses 
-                    if isinstance(a, dict) and extract_city_name(a.get("location_name", "")) == selected_city
-                ]
-            
-            if not analyses:
                 st.warning(f"⚠️ Нет данных анализа для города **{selected_city}**. Запустите анализ заново.")
             else:
-                # Группируем по времени создания (последний анализ)
-                latest_analyses = {}
-                for a in analyses:
-                    if isinstance(a, dict):  # ✅ Проверка типа
-                        loc = a.get("location_name")
-                        if loc and loc not in latest_analyses:
-                            latest_analyses[loc] = a
+                st.warning("⚠️ Нет результатов анализа. Нажмите '📊 Анализ' в боковой панели.")
+        else:
+            # Последний анализ по каждой локации
+            latest_df = latest_analyses(selected_hours, city_param(selected_city))
+            
+            if latest_df.empty:
+                st.warning("⚠️ Не удалось обработать результаты анализа.")
+            else:
+                # Показываем детальный анализ от LLM
+                first_analysis = latest_df.iloc[0]
                 
-                if not latest_analyses:
-                    st.warning("⚠️ Не удалось обработать результаты анализа.")
-                else:
-                    # Показываем детальный анализ от LLM
-                    first_analysis = list(latest_analyses.values())[0]
-                    
-                    st.markdown("---")
-                    st.subheader("🤖 Экспертный анализ от AI")
-                    
-                    # Краткое резюме
-                    summary = first_analysis.get('summary', 'N/A')
-                    st.success(f"**📝 Резюме:** {summary}")
-                    
-                    # Детальный анализ
-                    detailed = first_analysis.get('detailed_analysis', 'Детальный анализ недоступен.')
-                    st.markdown(f"""
-                    <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
-                                padding: 20px; 
-                                border-radius: 10px; 
-                                color: white; 
-                                margin: 20px 0'>
-                        <h3 style='color: white; margin-top: 0'>💬 Мнение AI-эксперта</h3>
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    st.markdown(detailed)
+                st.markdown("---")
+                st.subheader("🤖 Экспертный анализ от AI")
+                
+                # Краткое резюме
+                summary = first_analysis.get('summary', 'N/A')
+                st.success(f"**📝 Резюме:** {summary}")
+                
+                # Детальный анализ
+                detailed = first_analysis.get('detailed_analysis', 'Детальный анализ недоступен.')
+                st.markdown(f"""
+                <div style='background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); 
+                            padding: 20px; 
+                            border-radius: 10px; 
+                            color: white; 
+                            margin: 20px 0'>
+                    <h3 style='color: white; margin-top: 0'>💬 Мнение AI-эксперта</h3>
+                </div>
+                """, unsafe_allow_html=True)
+                
+                st.markdown(detailed)
+                
+                st.markdown("---")
+                
+                # Таблица результатов
+                st.subheader("📊 Детальные результаты по локациям")
+                
+                try:
+                    analysis_df = analysis_table(latest_df)
                     
-                    st.markdown("---")
+                    st.dataframe(analysis_df, use_container_width=True)
                     
-                    # Таблица результатов
-                    st.subheader("📊 Детальные результаты по локациям")
+                    # Визуализация
+                    col1, col2 = st.columns(2)
                     
-                    try:
-                        analysis_df = pd.DataFrame([
-                            {
-                                "Локация": a.get("location_name", "N/A"),
-                                "Тренд PM2.5": a.get("pm25_trend", "N/A"),
-                                "Средний PM2.5": f"{a.get('pm25_avg', 0):.1f}",
-                                "Аномалии": a.get("anomalies_count", 0),
-                                "Дата анализа": pd.to_datetime(a.get("created_at")).strftime("%d.%m.%Y %H:%M") if a.get("created_at") else "N/A"
-                            }
-                            for a in latest_analyses.values()
-                            if isinstance(a, dict)
-                        ])
-                        
-                        st.dataframe(analysis_df, use_container_width=True)
-                        
-                        # Визуализация
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            if 'Тренд PM2.5' in analysis_df.columns:
-                                trend_counts = analysis_df['Тренд PM2.5'].value_counts()
-                                fig_trends = go.Figure(data=[go.Pie(
-                                    labels=trend_counts.index,
-                                    values=trend_counts.values,
-                                    hole=0.3
-                                )])
-                                fig_trends.update_layout(title="Распределение трендов")
-                                st.plotly_chart(fig_trends, use_container_width=True)
-                        
-                        with col2:
-                            if 'Аномалии' in analysis_df.columns and len(analysis_df) > 0:
-                                top_anomalies = analysis_df.nlargest(min(5, len(analysis_df)), 'Аномалии')
-                                fig_anomalies = go.Figure(data=[go.Bar(
-                                    x=top_anomalies['Локация'],
-                                    y=top_anomalies['Аномалии'],
-                                    marker_color='indianred'
-                                )])
-                                fig_anomalies.update_layout(title="Топ-5 локаций по аномалиям")
-                                st.plotly_chart(fig_anomalies, use_container_width=True)
+                    with col1:
+                        if 'Тренд PM2.5' in analysis_df.columns:
+                            trend_counts = analysis_df['Тренд PM2.5'].value_counts()
+                            fig_trends = go.Figure(data=[go.Pie(
+                                labels=trend_counts.index,
+                                values=trend_counts.values,
+                                hole=0.3
+                            )])
+                            fig_trends.update_layout(title="Распределение трендов")
+                            st.plotly_chart(fig_trends, use_container_width=True)
                     
-                    except Exception as e:
-                        st.error(f"Ошибка визуализации: {e}")
-                        # Показываем сырые данные для отладки
-                        with st.expander("🔍 Отладка: сырые данные"):
-                            st.json(list(latest_analyses.values())[:3])
+                    with col2:
+                        if 'Аномалии' in analysis_df.columns and len(analysis_df) > 0:
+                            top_anomalies = analysis_df.nlargest(min(5, len(analysis_df)), 'Аномалии')
+                            fig_anomalies = go.Figure(data=[go.Bar(
+                                x=top_anomalies['Локация'],
+                                y=top_anomalies['Аномалии'],
+                                marker_color='indianred'
+                            )])
+                            fig_anomalies.update_layout(title="Топ-5 локаций по аномалиям")
+                            st.plotly_chart(fig_anomalies, use_container_width=True)
+                
+                except Exception as e:
+                    st.error(f"Ошибка визуализации: {e}")
+                    # Показываем сырые данные для отладки
+                    with st.expander("🔍 Отладка: сырые данные"):
+                        st.json(latest_df.head(3).to_json(orient="records", date_format="iso", force_ascii=False))
     
     except httpx.HTTPStatusError as e:
         st.error(f"Ошибка HTTP {e.response.status_code}: {e.response.text}")
@@ -597,15 +882,10 @@ with tab6:
     
     # Alerts
     st.subheader("🚨 Активные алерты")
-    alerts = fetch_alerts()
     if alerts:
-        alerts_df = pd.DataFrame(alerts)
-        if selected_city != "Все города":
-            alerts_df['city'] = alerts_df['location_name'].apply(extract_city_name)
-            alerts_df = alerts_df[alerts_df['city'] == selected_city]
-        
-        if not alerts_df.empty:
-            st.dataframe(alerts_df[['location_name', 'severity', 'message', 'created_at']], use_container_width=True)
+        city_alerts = filter_by_city(alerts, selected_city)
+        if city_alerts:
+            st.dataframe(records_table(city_alerts, ['location_name', 'severity', 'message', 'created_at']), use_container_width=True)
         else:
             st.success("✅ Нет алертов")
     else:
@@ -613,23 +893,17 @@ with tab6:
     
     # Forecasts
     st.subheader("🔮 Прогнозы")
-    forecasts = fetch_forecasts()
     if forecasts:
-        forecasts_df = pd.DataFrame(forecasts)
-        if selected_city != "Все города":
-            forecasts_df['city'] = forecasts_df['location_name'].apply(extract_city_name)
-            forecasts_df = forecasts_df[forecasts_df['city'] == selected_city]
-        
-        if not forecasts_df.empty:
-            st.dataframe(forecasts_df[['location_name', 'forecast_time', 'predicted_pm25', 'predicted_aqi']], use_container_width=True)
+        city_forecasts = filter_by_city(forecasts, selected_city)
+        if city_forecasts:
+            st.dataframe(records_table(city_forecasts, ['location_name', 'forecast_time', 'predicted_pm25', 'predicted_aqi']), use_container_width=True)
     else:
         st.info("Нет прогнозов")
     
     # Measurements
     st.subheader("📊 Измерения")
-    if measurements:
-        measurements_df = pd.DataFrame(measurements[:100])
-        st.dataframe(measurements_df[['location_name', 'timestamp', 'pm25', 'pm10', 'temperature']], use_container_width=True)
+    if not measurements_df.empty:
+        st.dataframe(measurements_df.head(100)[['location_name', 'timestamp', 'pm25', 'pm10', 'temperature']], use_container_width=True)
 
 # Footer
 st.divider()